@@ -0,0 +1,134 @@
+#############################
+# alignment.py
+#############################
+# Maps script words onto transcribed words with a banded edit-distance DP.
+# Every row of the DP is computed with numpy; insertions along a row are
+# resolved with a running minimum, so long scripts stay fast.
+import re
+
+import numpy as np
+
+SCRIPT_WORD_RE = re.compile(r"\b[\w]+(?:['’][\w]+)?\b")
+
+# traceback codes
+_DIAG, _UP, _LEFT = 0, 1, 2
+
+
+def normalize_token(word):
+    """Lowercase, unify apostrophes and drop punctuation: " Don’t," -> "don't" """
+    word = word.lower().replace("’", "'")
+    return re.sub(r"[^\w']+", "", word).strip("'")
+
+
+def align_tokens(script_tokens, audio_tokens, band=None):
+    """
+    Global alignment of two token lists with unit insertion, deletion and
+    substitution costs, restricted to a band around the diagonal.
+    Returns (mapping, score):
+      mapping[i] is the index of the audio token aligned with script token i,
+      or None when the script word was not heard;
+      score is the fraction of exact token matches over the longer list.
+    """
+    n, m = len(script_tokens), len(audio_tokens)
+    if n == 0 or m == 0:
+        return [None] * n, 0.0
+
+    vocab = {}
+    a = np.array([vocab.setdefault(t, len(vocab)) for t in script_tokens], dtype=np.int64)
+    b = np.array([vocab.setdefault(t, len(vocab)) for t in audio_tokens], dtype=np.int64)
+
+    if band is None:
+        band = abs(n - m) + 32
+    inf = n + m + 1
+
+    def window(i):
+        center = i * m / n
+        return max(0, int(center - band)), min(m + 1, int(center + band) + 1)
+
+    # row 0: only insertions
+    lo, hi = window(0)
+    prev_lo, prev = lo, np.arange(lo, hi, dtype=np.int64)
+    pointers = [(lo, np.full(hi - lo, _LEFT, dtype=np.int8))]
+
+    for i in range(1, n + 1):
+        lo, hi = window(i)
+        cols = np.arange(lo, hi)
+        prev_hi = prev_lo + len(prev)
+
+        # deletion of script word i-1: D[i-1][j] + 1
+        up = np.full(hi - lo, inf, dtype=np.int64)
+        ok = (cols >= prev_lo) & (cols < prev_hi)
+        up[ok] = prev[cols[ok] - prev_lo] + 1
+
+        # match / substitution: D[i-1][j-1] + (a != b)
+        diag = np.full(hi - lo, inf, dtype=np.int64)
+        ok = (cols >= 1) & (cols - 1 >= prev_lo) & (cols - 1 < prev_hi)
+        diag[ok] = prev[cols[ok] - 1 - prev_lo] + (b[cols[ok] - 1] != a[i - 1])
+
+        best = np.minimum(diag, up)
+        ptr = np.where(diag <= up, _DIAG, _UP).astype(np.int8)
+
+        # insertion of audio word j-1: D[i][j] = min_k<=j (best[k] + j - k)
+        row = np.minimum.accumulate(best - cols) + cols
+        ptr[row < best] = _LEFT
+
+        pointers.append((lo, ptr))
+        prev_lo, prev = lo, row
+
+    # traceback from (n, m)
+    mapping = [None] * n
+    matches = 0
+    i, j = n, m
+    while i > 0 or j > 0:
+        lo, ptr = pointers[i]
+        move = ptr[j - lo] if i > 0 else _LEFT
+        if move == _DIAG:
+            mapping[i - 1] = j - 1
+            matches += int(a[i - 1] == b[j - 1])
+            i, j = i - 1, j - 1
+        elif move == _UP:
+            i -= 1
+        else:
+            j -= 1
+
+    return mapping, matches / max(n, m)
+
+
+def interpolate_timings(timings, default_duration=0.2):
+    """
+    Fill the None entries of a list of (start, end) tuples in place.
+    A run of missing words shares the gap between its neighbours; when the
+    neighbours touch, the previous word gives up the second half of its time.
+    """
+    n = len(timings)
+    idx = 0
+    while idx < n:
+        if timings[idx] is not None:
+            idx += 1
+            continue
+        run_start = idx
+        while idx < n and timings[idx] is None:
+            idx += 1
+        count = idx - run_start
+        prev = timings[run_start - 1] if run_start > 0 else None
+        nxt = timings[idx] if idx < n else None
+
+        if prev is None and nxt is None:
+            lo, hi = 0.0, count * default_duration
+        elif prev is None:
+            hi = nxt[0]
+            lo = max(0.0, hi - count * default_duration)
+        elif nxt is None:
+            lo = prev[1]
+            hi = lo + count * default_duration
+        else:
+            lo, hi = prev[1], nxt[0]
+            if hi - lo < 0.02 * count:
+                # no silence to use: split the previous word
+                lo = (prev[0] + prev[1]) / 2
+                timings[run_start - 1] = (prev[0], lo)
+
+        step = (hi - lo) / count if hi > lo else 0.0
+        for k in range(count):
+            timings[run_start + k] = (lo + k * step, lo + (k + 1) * step)
+    return timings
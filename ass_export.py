@@ -0,0 +1,306 @@
+#############################
+# ass_export.py
+#############################
+# Advanced SubStation Alpha export of the subtitle pages. Every page of
+# `subtitles.layout_subtitles` becomes a rounded background drawing, one event
+# per word with its normal style at the laid-out position, and a highlight box
+# plus highlight text shown only while the word is spoken. With the video size
+# as PlayRes, ASS coordinates are output pixels, so libass (ffmpeg's
+# `subtitles` filter) draws the pages where the numpy overlay would.
+import argparse
+import os
+import struct
+import subprocess
+
+import numpy as np
+from PIL import ImageColor
+
+from font_metrics import load_font
+
+# cubic Bezier approximation of a quarter circle
+_KAPPA = 0.5523
+
+
+def ass_color(color):
+    """'&HAABBGGRR' of a PIL color; ASS alpha 00 is opaque"""
+    r, g, b, a = ImageColor.getcolor(color, "RGBA")
+    return f"&H{255 - a:02X}{b:02X}{g:02X}{r:02X}"
+
+
+def ass_time(seconds):
+    """H:MM:SS.cc"""
+    cs = max(0, int(round(seconds * 100)))
+    return f"{cs // 360000}:{cs // 6000 % 60:02d}:{cs // 100 % 60:02d}.{cs % 100:02d}"
+
+
+def ass_text(text):
+    """Escape override braces and stop backslashes from starting \\N, \\n or \\h"""
+    return text.replace("\\", "\\\u200b").replace("{", "\\{").replace("}", "\\}")
+
+
+def _lead_advance(text, text_style):
+    """
+    (text without leading whitespace, advance of that whitespace in pixels).
+    libass drops leading whitespace in a positioned event while the sprites,
+    and the laid-out widths, start with it (e.g. Whisper's " The").
+    """
+    stripped = text.lstrip()
+    if stripped == text:
+        return text, 0.0
+    font = load_font(text_style[0], text_style[1])
+    return stripped, font.getlength(text) - font.getlength(stripped)
+
+
+def _fill_tags(color):
+    """Primary color and alpha override tags of a drawing"""
+    code = ass_color(color)
+    return f"\\1c&H{code[4:]}&\\1a&H{code[2:4]}&"
+
+
+def _sfnt_tables(data):
+    num_tables = struct.unpack(">H", data[4:6])[0]
+    tables = {}
+    for i in range(num_tables):
+        tag, _, offset, length = struct.unpack(">4sIII", data[12 + 16 * i:28 + 16 * i])
+        tables[tag.decode("latin-1")] = (offset, length)
+    return tables
+
+
+def ass_font_size(font, font_size):
+    """
+    ASS font size drawing glyphs at PIL's `font_size` (pixels per em).
+    libass sizes a font so that usWinAscent + usWinDescent of the OS/2 table
+    equals the ASS size, PIL sizes the em square.
+    """
+    with open(font, "rb") as f:
+        data = f.read()
+    try:
+        tables = _sfnt_tables(data)
+        head, _ = tables["head"]
+        os2, _ = tables["OS/2"]
+        units_per_em = struct.unpack(">H", data[head + 18:head + 20])[0]
+        win_ascent, win_descent = struct.unpack(">HH", data[os2 + 74:os2 + 78])
+    except (KeyError, struct.error):
+        return font_size
+    if not win_ascent + win_descent or not units_per_em:
+        return font_size
+    return round(font_size * (win_ascent + win_descent) / units_per_em, 2)
+
+
+def font_family(font):
+    """(family name, bold) of a font file, as libass looks it up"""
+    family, style = load_font(font, 12).getname()
+    return family, "bold" in (style or "").lower()
+
+
+def rounded_rect_drawing(w, h, r):
+    """ASS drawing (\\p1) of a w x h rectangle with corner radius r, origin top-left"""
+    r = max(0, min(r, w / 2, h / 2))
+    k = r * (1 - _KAPPA)
+
+    def n(v):
+        return f"{v:g}"
+
+    if r == 0:
+        return f"m 0 0 l {n(w)} 0 {n(w)} {n(h)} 0 {n(h)}"
+    return " ".join([
+        f"m {n(r)} 0 l {n(w - r)} 0",
+        f"b {n(w - k)} 0 {n(w)} {n(k)} {n(w)} {n(r)}",
+        f"l {n(w)} {n(h - r)}",
+        f"b {n(w)} {n(h - k)} {n(w - k)} {n(h)} {n(w - r)} {n(h)}",
+        f"l {n(r)} {n(h)}",
+        f"b {n(k)} {n(h)} 0 {n(h - k)} 0 {n(h - r)}",
+        f"l 0 {n(r)}",
+        f"b 0 {n(k)} {n(k)} 0 {n(r)} 0",
+    ])
+
+
+class _Styles:
+    """ASS [V4+ Styles] built from the text styles of the words, one per distinct style"""
+
+    def __init__(self):
+        self.names = {}
+        self.lines = [
+            "Style: Box,Arial,20,&H00FFFFFF,&H00FFFFFF,&H00000000,&H00000000,"
+            "0,0,0,0,100,100,0,0,1,0,0,7,0,0,0,1"
+        ]
+
+    def name(self, text_style):
+        # (font, font_size, color, stroke_color, stroke_width, bg_color) of text_sprite
+        font, font_size, color, stroke_color, stroke_width, _ = text_style
+        key = (font, font_size, color, stroke_color, stroke_width)
+        if key not in self.names:
+            name = self.names[key] = f"Word{len(self.names)}"
+            family, bold = font_family(font)
+            outline = stroke_width if stroke_color is not None else 0
+            self.lines.append(
+                f"Style: {name},{family},{ass_font_size(font, font_size)},{ass_color(color)},{ass_color(color)},"
+                f"{ass_color(stroke_color or 'black')},&H00000000,{-1 if bold else 0},0,0,0,100,100,0,0,1,"
+                f"{outline},0,4,0,0,0,1"
+            )
+        return self.names[key]
+
+
+def ass_document(pages, video_size, playback_speed=1.0, offset=0.0):
+    """
+    ASS script of laid-out subtitle pages (`layout_subtitles(..., rasterize=False)`).
+    Page times are divided by `playback_speed` and shifted by -`offset` seconds,
+    so they match output video time.
+    """
+    width, height = video_size
+    styles = _Styles()
+    events = []
+
+    def event(layer, start, end, style, text):
+        start, end = start / playback_speed - offset, end / playback_speed - offset
+        if end > 0 and end > start:
+            events.append(f"Dialogue: {layer},{ass_time(start)},{ass_time(end)},{style},,0,0,0,,{text}")
+
+    for page in pages:
+        layout = page['layout']
+        page_w, page_h = int(layout['width']), int(layout['height'])
+        # same placement as SubtitleOverlay.render
+        px, py = int((width - page_w) / 2), int(page['sub_position'])
+        start, end = page['start'], page['end']
+
+        if page_w > 0 and page_h > 0:
+            event(0, start, end, "Box",
+                  f"{{\\an7\\pos({px},{py}){_fill_tags(page['bg_color'])}\\p1}}"
+                  f"{rounded_rect_drawing(page_w, page_h, page['bg_radius'])}")
+
+        for placed in layout['words']:
+            w = placed['word']
+            nx, ny = placed['normal_pos']
+            text, lead = _lead_advance(w['text'], w['style']['normal'])
+            event(1, start, end, styles.name(w['style']['normal']),
+                  f"{{\\an4\\pos({px + int(nx) + lead:g},{py + int(ny) + w['normal_h'] / 2:g})}}{ass_text(text)}")
+
+            if placed['h_window'] is None:
+                continue
+            h_start, h_end = start + placed['h_window'][0], start + placed['h_window'][1]
+            bx, by = placed['highlight_bg_pos']
+            bg_color, bg_radius = w['style']['highlight_bg']
+            event(2, h_start, h_end, "Box",
+                  f"{{\\an7\\pos({px + int(bx)},{py + int(by)}){_fill_tags(bg_color)}\\p1}}"
+                  f"{rounded_rect_drawing(w['highlight_w'], w['highlight_h'], bg_radius)}")
+            hx, hy = placed['highlight_txt_pos']
+            text_h = w['highlight_h'] - 2 * page['padding']
+            text, lead = _lead_advance(w['text'], w['style']['highlight'])
+            event(3, h_start, h_end, styles.name(w['style']['highlight']),
+                  f"{{\\an4\\pos({px + int(hx) + lead:g},{py + int(hy) + text_h / 2:g})}}{ass_text(text)}")
+
+    return "\n".join([
+        "[Script Info]",
+        "ScriptType: v4.00+",
+        f"PlayResX: {width}",
+        f"PlayResY: {height}",
+        "WrapStyle: 2",
+        "ScaledBorderAndShadow: yes",
+        "",
+        "[V4+ Styles]",
+        "Format: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, "
+        "Bold, Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, "
+        "Alignment, MarginL, MarginR, MarginV, Encoding",
+        *styles.lines,
+        "",
+        "[Events]",
+        "Format: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text",
+        *events,
+        "",
+    ])
+
+
+def write_ass(pages, path, video_size, playback_speed=1.0, offset=0.0):
+    """Write the ASS script of `pages` (see `ass_document`) to `path`"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(ass_document(pages, video_size, playback_speed, offset))
+    return path
+
+
+def _escape_filter_value(value):
+    # option value level, then filtergraph level
+    for char in "\\':":
+        value = value.replace(char, "\\" + char)
+    for char in "\\'[],;":
+        value = value.replace(char, "\\" + char)
+    return value
+
+
+def subtitles_filter(ass_path, fonts_dir="fonts"):
+    """ffmpeg `subtitles` filter burning `ass_path` in, with the fonts of `fonts_dir`"""
+    args = f"filename={_escape_filter_value(os.path.abspath(ass_path))}"
+    if fonts_dir and os.path.isdir(fonts_dir):
+        args += f":fontsdir={_escape_filter_value(os.path.abspath(fonts_dir))}"
+    return f"subtitles={args}"
+
+
+def burn_in_frame(ass_path, video_size, t, background=(128, 128, 128)):
+    """(h, w, 3) frame at `t` of `ass_path` burnt in by libass over a solid background"""
+    w, h = video_size
+    color = "0x%02x%02x%02x" % tuple(background)
+    cmd = ["ffmpeg", "-loglevel", "error", "-f", "lavfi",
+           "-i", f"color=c={color}:s={w}x{h}:r=100:d={t + 1:.2f},format=rgb24",
+           "-vf", subtitles_filter(ass_path), "-ss", f"{t:.2f}", "-frames:v", "1",
+           "-f", "rawvideo", "-pix_fmt", "rgb24", "-"]
+    data = subprocess.run(cmd, check=True, stdout=subprocess.PIPE).stdout
+    return np.frombuffer(data, dtype=np.uint8).reshape(h, w, 3)
+
+
+def _text_extent(frame, threshold=200):
+    """(x0, x1, y0, y1) of the near-white pixels (the normal text), None if there are none"""
+    ys, xs = np.nonzero(frame.min(axis=2) >= threshold)
+    if not len(xs):
+        return None
+    return int(xs.min()), int(xs.max()), int(ys.min()), int(ys.max())
+
+
+def burn_in_check(aligned_data, video_size, sub_position, times, ass_path, **style):
+    """
+    Compare the libass burn-in with `SubtitleOverlay.render` at every time of
+    `times` (seconds): the extent of the white text pixels in both frames.
+    Returns a list of (t, overlay extent, ass extent); glyph edges differ
+    between the two rasterizers, positions should agree within a pixel or two.
+    """
+    from subtitle_overlay import SubtitleOverlay
+    from subtitles import layout_subtitles
+
+    pages = layout_subtitles(aligned_data, video_size[1], sub_position, **style)
+    write_ass(pages, ass_path, video_size)
+    overlay = SubtitleOverlay(pages)
+    canvas = np.full((video_size[1], video_size[0], 3), 128, dtype=np.uint8)
+    results = []
+    for t in times:
+        results.append((t, _text_extent(overlay.render(canvas, t)),
+                        _text_extent(burn_in_frame(ass_path, video_size, t))))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the libass burn-in against the numpy subtitle overlay")
+    parser.add_argument("--text", default="The quick brown fox jumps over the lazy dog",
+                        help="Words shown one after another, 0.5 s each")
+    parser.add_argument("--resolution", default="1080x1920")
+    parser.add_argument("--sub_pos", type=float, default=60)
+    parser.add_argument("--output", default="temp/burn_in_check.ass", help="Where the .ass file is written")
+    parser.add_argument("--tolerance", type=int, default=2, help="Allowed difference in pixels")
+    args = parser.parse_args()
+
+    words = [{'text': " " + word, 'start': 0.5 * i, 'end': 0.5 * i + 0.4}
+             for i, word in enumerate(args.text.split())]
+    aligned_data = [{'words': words, 'start': words[0]['start'], 'end': words[-1]['end']}]
+    video_size = tuple(int(v) for v in args.resolution.lower().split("x"))
+    times = [w['start'] + 0.2 for w in words]
+
+    failures = 0
+    for t, expected, actual in burn_in_check(aligned_data, video_size, args.sub_pos, times, args.output):
+        ok = (expected is not None and actual is not None
+              and max(abs(a - b) for a, b in zip(expected, actual)) <= args.tolerance)
+        failures += not ok
+        print(f"t={t:.2f}s overlay {expected} ass {actual}" + ("" if ok else "  MISMATCH"))
+    print(f"{len(times) - failures}/{len(times)} frames within {args.tolerance} px")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,240 @@
+#############################
+# audio_mix.py
+#############################
+# The whole audio chain (voiceover tempo, background volume and looping, and
+# the final mix) as one ffmpeg filtergraph writing a lossless WAV.
+# With ducking, the tracks are decoded once and mixed with numpy instead: the
+# background is crossfade-looped to length and its gain follows an envelope
+# that dips while the voiceover speaks (from its RMS or the word timestamps).
+import os
+import shutil
+import subprocess
+import wave
+
+import numpy as np
+
+from cache import CACHE_ROOT, DiskCache, file_digest, make_key
+
+MIX_CACHE = DiskCache(os.path.join(CACHE_ROOT, "mix"), max_bytes=512 * 1024 * 1024, suffix=".wav")
+
+# envelope resolution, control frames per second
+ENVELOPE_RATE = 100
+
+DEFAULT_DUCKING = {
+    'source': 'words',      # "words" (aligned word timestamps) or "rms" (voiceover level)
+    'depth_db': 12.0,       # background attenuation while the voice speaks
+    'attack': 0.08,         # seconds to reach full ducking, starting before the speech
+    'release': 0.4,         # seconds to recover after the speech
+    'threshold_db': -40.0,  # rms source: control frames above this level (dBFS) are speech
+    'crossfade': 0.5,       # seconds of equal-power crossfade at every background loop
+}
+
+
+def atempo_filters(speed):
+    """
+    atempo filters for `speed`. A single atempo instance only accepts factors
+    in [0.5, 2.0] on older ffmpeg builds, so larger changes are chained.
+    """
+    if not speed > 0:
+        raise ValueError(f"Invalid playback speed {speed}, expected a positive number")
+    filters = []
+    while speed > 2.0:
+        filters.append("atempo=2.0")
+        speed /= 2.0
+    while speed < 0.5:
+        filters.append("atempo=0.5")
+        speed /= 0.5
+    filters.append(f"atempo={speed}")
+    return filters
+
+
+def mix_audio_command(voice_path, output_path, playback_speed=1.0, background_path=None,
+                      background_volume=0.3, duration=None, sample_rate=44100, start=None):
+    """ffmpeg command line for `mix_audio`"""
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-i", voice_path]
+    voice_chain = atempo_filters(playback_speed)
+
+    if background_path is not None:
+        # Loop the background forever, the mix is cut to the voiceover (or `duration`)
+        cmd += ["-stream_loop", "-1", "-i", background_path]
+        if duration is not None:
+            # Pad the voiceover with silence so the background plays until `duration`
+            voice_chain.append("apad")
+        graph = (
+            f"[0:a]{','.join(voice_chain)}[voice];"
+            f"[1:a]volume={background_volume}[bg];"
+            "[voice][bg]amix=inputs=2:duration=first:dropout_transition=0:normalize=0[mix]"
+        )
+    else:
+        graph = f"[0:a]{','.join(voice_chain)}[mix]"
+
+    cmd += ["-filter_complex", graph, "-map", "[mix]"]
+    if start:
+        cmd += ["-ss", f"{start:.6f}"]
+    if duration is not None:
+        cmd += ["-t", f"{duration:.6f}"]
+    cmd += ["-ar", str(sample_rate), "-ac", "2", "-c:a", "pcm_s16le", output_path]
+    return cmd
+
+
+def mix_audio(voice_path, output_path, playback_speed=1.0, background_path=None,
+              background_volume=0.3, duration=None, sample_rate=44100, start=None):
+    """
+    Speed up the voiceover, scale and loop the background music to length and
+    mix both in a single ffmpeg run. The result is written as 16-bit PCM WAV
+    so the final encode is the only lossy step.
+    duration: length of the mix in seconds, None keeps the sped-up voiceover length
+    start: skip this many seconds of the mix (partial renders)
+    """
+    cmd = mix_audio_command(voice_path, output_path, playback_speed, background_path,
+                            background_volume, duration, sample_rate, start)
+    subprocess.run(cmd, check=True)
+    return output_path
+
+
+def ducking_profile(**overrides):
+    """Default ducking parameters updated with the non-None `overrides`"""
+    profile = dict(DEFAULT_DUCKING)
+    for key, value in overrides.items():
+        if key not in profile:
+            raise ValueError(f"Unknown ducking option: {key}")
+        if value is not None:
+            profile[key] = value
+    if profile['source'] not in ("words", "rms"):
+        raise ValueError(f"Unknown ducking source '{profile['source']}', expected 'words' or 'rms'")
+    return profile
+
+
+def decode_audio(path, sample_rate=44100, playback_speed=1.0):
+    """(n, 2) float32 samples of `path` resampled to `sample_rate`, tempo-changed by `playback_speed`"""
+    cmd = ["ffmpeg", "-loglevel", "error", "-i", path]
+    if playback_speed != 1.0:
+        cmd += ["-af", ",".join(atempo_filters(playback_speed))]
+    cmd += ["-ar", str(sample_rate), "-ac", "2", "-f", "f32le", "-"]
+    data = subprocess.run(cmd, check=True, stdout=subprocess.PIPE).stdout
+    return np.frombuffer(data, dtype=np.float32).reshape(-1, 2)
+
+
+def speech_mask_rms(samples, sample_rate, threshold_db):
+    """Speech mask per control frame: frame RMS of the voiceover above `threshold_db` dBFS"""
+    hop = sample_rate // ENVELOPE_RATE
+    n_frames = -(-len(samples) // hop)
+    mono = np.zeros(n_frames * hop, dtype=np.float32)
+    mono[:len(samples)] = samples.mean(axis=1)
+    rms = np.sqrt(np.mean(mono.reshape(n_frames, hop) ** 2, axis=1))
+    return rms > 10 ** (threshold_db / 20)
+
+
+def speech_mask_words(aligned_data, n_frames, playback_speed=1.0):
+    """Speech mask per control frame from the word timestamps (timeline seconds)"""
+    spans = np.array([(w['start'], w['end']) for segment in aligned_data for w in segment['words']],
+                     dtype=np.float64).reshape(-1, 2)
+    bounds = np.clip(np.round(spans / playback_speed * ENVELOPE_RATE).astype(np.int64), 0, n_frames)
+    # +1 at every word start, -1 after every end: the running sum is > 0 inside words
+    edges = np.zeros(n_frames + 1, dtype=np.int64)
+    np.add.at(edges, bounds[:, 0], 1)
+    np.add.at(edges, bounds[:, 1], -1)
+    return np.cumsum(edges[:-1]) > 0
+
+
+def duck_envelope(mask, attack, release, depth_db):
+    """
+    Background gain per control frame for a speech `mask`: 1 away from speech,
+    10^(-depth_db/20) during it, with linear ramps of `attack` seconds before
+    each speech onset and `release` seconds after each end.
+    """
+    n = len(mask)
+    idx = np.arange(n)
+    if not mask.any():
+        return np.ones(n)
+    # control frames since the last speech frame and until the next one
+    last = np.maximum.accumulate(np.where(mask, idx, -n - 1))
+    next_ = np.minimum.accumulate(np.where(mask, idx, 2 * n + 1)[::-1])[::-1]
+    attack_frames = max(attack * ENVELOPE_RATE, 1.0)
+    release_frames = max(release * ENVELOPE_RATE, 1.0)
+    amount = np.maximum(np.clip(1 - (idx - last) / release_frames, 0, 1),
+                        np.clip(1 - (next_ - idx) / attack_frames, 0, 1))
+    return 1 - amount * (1 - 10 ** (-depth_db / 20))
+
+
+def loop_crossfade(samples, n, crossfade):
+    """
+    `samples` repeated to `n` samples; every loop point overlaps the tail of
+    one pass with the head of the next over `crossfade` samples (equal power).
+    """
+    length = len(samples)
+    if length == 0:
+        return np.zeros((n,) + samples.shape[1:], dtype=samples.dtype)
+    if length >= n:
+        return samples[:n]
+    crossfade = int(min(crossfade, length // 2))
+    period = length - crossfade
+    pos = np.arange(n)
+    offset = pos % period
+    out = samples[offset]
+    if crossfade:
+        # the head of every pass after the first fades in over the previous tail
+        fade = (pos >= period) & (offset < crossfade)
+        phase = offset[fade] / crossfade * (np.pi / 2)
+        out[fade] = (samples[offset[fade]] * np.sin(phase)[:, None]
+                     + samples[offset[fade] + period] * np.cos(phase)[:, None])
+    return out
+
+
+def _write_wav(path, samples, sample_rate):
+    pcm = np.round(np.clip(samples, -1.0, 1.0) * 32767).astype("<i2")
+    with wave.open(path, "wb") as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(pcm.tobytes())
+
+
+def mix_ducked(voice_path, output_path, background_path, playback_speed=1.0, background_volume=0.3,
+               ducking=None, aligned_data=None, duration=None, sample_rate=44100, start=None,
+               voice_digest=None, background_digest=None):
+    """
+    `mix_audio` with the background ducked under the voice (see `ducking_profile`),
+    computed with numpy over the decoded tracks. Mixes are cached by the audio
+    content, the word timings (words source) and every parameter.
+    aligned_data: aligned segments with word timestamps, needed by the words source
+    voice_digest, background_digest: sha256 of the files when already known
+    """
+    ducking = ducking_profile(**(ducking or {}))
+    if ducking['source'] == "words" and aligned_data is None:
+        raise ValueError("Ducking from word timestamps needs the aligned data")
+    words = None
+    if ducking['source'] == "words":
+        words = [[w['start'], w['end']] for segment in aligned_data for w in segment['words']]
+    key = make_key("mix", voice_digest or file_digest(voice_path),
+                   background_digest or file_digest(background_path), playback_speed, background_volume,
+                   ducking, words, duration, sample_rate, start)
+    cached = MIX_CACHE.get_path(key)
+    if cached is not None:
+        shutil.copyfile(cached, output_path)
+        return output_path
+
+    voice = decode_audio(voice_path, sample_rate, playback_speed)
+    start_sample = int(round((start or 0) * sample_rate))
+    n = len(voice) if duration is None else start_sample + int(round(duration * sample_rate))
+
+    hop = sample_rate // ENVELOPE_RATE
+    n_frames = -(-n // hop)
+    if ducking['source'] == "rms":
+        mask = np.zeros(n_frames, dtype=bool)
+        voice_mask = speech_mask_rms(voice[:n], sample_rate, ducking['threshold_db'])
+        mask[:len(voice_mask)] = voice_mask[:n_frames]
+    else:
+        mask = speech_mask_words(aligned_data, n_frames, playback_speed)
+    envelope = duck_envelope(mask, ducking['attack'], ducking['release'], ducking['depth_db'])
+    # control frame k covers samples [k * hop, (k + 1) * hop), interpolate at the centres
+    gain = np.interp(np.arange(n), (np.arange(n_frames) + 0.5) * hop, envelope) * background_volume
+
+    background = decode_audio(background_path, sample_rate)
+    mix = loop_crossfade(background, n, ducking['crossfade'] * sample_rate) * gain[:, None].astype(np.float32)
+    mix[:min(len(voice), n)] += voice[:n]
+
+    _write_wav(output_path, mix[start_sample:], sample_rate)
+    cached = MIX_CACHE.put_file(key, output_path)
+    shutil.copyfile(cached, output_path)
+    return output_path
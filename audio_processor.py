@@ -2,144 +2,413 @@
 # audio_processor.py
 #############################
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing.util import Finalize
+
 import whisper
-from moviepy.audio.io.AudioFileClip import AudioFileClip
-from utils import time_to_seconds
-import re
-import pickle
-CACHE_FILE = "temp/processed_result_cache.pkl"
+from utils import audio_info, time_to_seconds
+from alignment import SCRIPT_WORD_RE, align_tokens, interpolate_timings, normalize_token
+from cache import CACHE_ROOT, DiskCache, file_digest, make_key
+from transcription_worker import _load_model, _transcribe, transcribe_remote
+from audio_chunks import merge_chunk_results, silence_chunks
+from tracing import span
 
+WHISPER_MODEL = "medium"
+TRANSCRIBE_OPTIONS = {"word_timestamps": True, "fp16": False, "language": None}
+# Long voiceovers are cut at silences into about one chunk per worker, but
+# never into chunks shorter than this
+MIN_CHUNK_SECONDS = 15.0
+TRANSCRIBE_WORKERS = max(1, min(4, (os.cpu_count() or 1) // 2))
+TRANSCRIPTION_CACHE = DiskCache(os.path.join(CACHE_ROOT, "transcriptions"),
+                                max_bytes=256 * 1024 * 1024)
 
 
-def transcribe_with_timestamps(audio_path, train):
-    """Convert audio to text with word-level timestamps using Whisper"""
-    ####################Cache the processed audio####################
-    # Check if cached audio exists
-    if os.path.exists(CACHE_FILE) and not train:
-        print("Loading cached processed_audio...")
-        with open(CACHE_FILE, "rb") as f:
-            result = pickle.load(f)
-    else:
-        if os.path.exists(CACHE_FILE):
-            os.remove(CACHE_FILE)
+_MODELS = {}
+# (model_name, workers, pool) of the chunk transcription pool of this process
+_CHUNK_POOL = []
 
+
+def load_whisper_model(model_name=WHISPER_MODEL):
+    """Load a Whisper model once per process and keep it for later calls"""
+    if model_name not in _MODELS:
         print("loading speech to text model ....    ")
-        model = whisper.load_model("medium", device="cpu")
-        print("Processing audio and caching the result...")
-        result = model.transcribe(audio_path, fp16=False, word_timestamps=True)
+        with span("load_model", model=model_name):
+            _MODELS[model_name] = whisper.load_model(model_name, device="cpu")
+    return _MODELS[model_name]
+
+
+def transcription_key(audio_path, model_name, options, audio_digest=None):
+    """Cache key built from the audio content, the model and the decode options
+    audio_digest: sha256 of the audio file when already known (see probe.py)
+    """
+    return make_key("transcription", audio_digest or file_digest(audio_path), model_name, options)
+
+
+def _shutdown_chunk_pool():
+    while _CHUNK_POOL:
+        _CHUNK_POOL.pop()[2].shutdown()
+
+
+def chunk_pool(model_name, workers):
+    """
+    Process pool of `workers` model replicas, created on first use and kept
+    for the life of the process, so the replicas load the model only once.
+    Only one pool exists at a time; asking for another model or size replaces it.
+    """
+    if _CHUNK_POOL and _CHUNK_POOL[0][:2] != (model_name, workers):
+        _shutdown_chunk_pool()
+    if not _CHUNK_POOL:
+        threads = max(1, (os.cpu_count() or 1) // workers)
+        pool = ProcessPoolExecutor(workers, initializer=_load_model, initargs=(model_name, threads))
+        _CHUNK_POOL.append((model_name, workers, pool))
+        # runs at interpreter exit and, unlike atexit, also when this process is
+        # itself a pool worker (batch mode), before it waits for its children;
+        # the priority puts it ahead of the finalizers closing the pool's queues
+        Finalize(pool, _shutdown_chunk_pool, exitpriority=100)
+    return _CHUNK_POOL[0][2]
+
+
+def transcribe_chunks(chunks, options, model_name=WHISPER_MODEL, use_worker=True, workers=TRANSCRIBE_WORKERS):
+    """
+    Whisper results for a list of sample arrays, in order. The chunks go to
+    the resident worker concurrently when it is running. Otherwise a model
+    already loaded in this process (e.g. by the render service) transcribes
+    them one after another, and only without one are they spread over the
+    `chunk_pool` of `workers` processes.
+    """
+    if use_worker:
+        with ThreadPoolExecutor(len(chunks)) as pool:
+            results = list(pool.map(lambda chunk: transcribe_remote(chunk, options, model_name), chunks))
+        if all(result is not None for result in results):
+            print(f"Processed {len(chunks)} audio chunks on the transcription worker")
+            return results
+
+    if workers <= 1 or model_name in _MODELS:
+        model = load_whisper_model(model_name)
+        return [model.transcribe(chunk, **options) for chunk in chunks]
 
-    # Save to cache
-    os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
-    with open(CACHE_FILE, "wb") as f:
-        pickle.dump(result, f)
+    return list(chunk_pool(model_name, workers).map(_transcribe, chunks, [options] * len(chunks)))
 
-    ###############################################################   
+
+def transcribe_audio(audio_path, options, model_name=WHISPER_MODEL, use_worker=True, workers=TRANSCRIBE_WORKERS):
+    """
+    Whisper result for a whole file. Long audio is split at silences into
+    about one chunk per worker, the chunks are transcribed concurrently and
+    their timestamps are shifted back onto the file's timeline.
+    """
+    samples = whisper.load_audio(audio_path)
+    sample_rate = whisper.audio.SAMPLE_RATE
+    target = max(MIN_CHUNK_SECONDS, len(samples) / sample_rate / max(1, workers))
+    bounds = silence_chunks(samples, sample_rate, target)
+
+    if len(bounds) > 1:
+        print(f"Transcribing {len(bounds)} chunks split at silences...")
+        with span("transcribe_chunks", model=model_name, chunks=len(bounds)):
+            results = transcribe_chunks([samples[a:b] for a, b in bounds], options, model_name, use_worker, workers)
+        return merge_chunk_results(results, [a / sample_rate for a, _ in bounds])
+
+    result = None
+    if use_worker:
+        with span("transcribe_remote", model=model_name):
+            result = transcribe_remote(audio_path, options, model_name)
+    if result is not None:
+        print("Processed audio on the transcription worker")
+        return result
+
+    model = load_whisper_model(model_name)
+    with span("transcribe", model=model_name):
+        return model.transcribe(samples, **options)
+
+
+def transcribe_with_timestamps(audio_path, train, model_name=WHISPER_MODEL, language=None, use_worker=True,
+                               workers=TRANSCRIBE_WORKERS, audio_digest=None):
+    """Convert audio to text with word-level timestamps using Whisper
+    train: 1 forces a fresh transcription (the cache entry is refreshed), 0 reuses the cache
+    use_worker: route the job to the resident transcription worker when one is running
+    workers: processes used to transcribe the silence-split chunks of long audio
+    audio_digest: sha256 of the audio file when already known
+    """
+    options = dict(TRANSCRIBE_OPTIONS, language=language)
+    key = transcription_key(audio_path, model_name, options, audio_digest)
+
+    result = None
+    if not train:
+        result = TRANSCRIPTION_CACHE.get(key)
+
+    if result is not None:
+        print("Loading cached processed_audio...")
+    else:
+        print("Processing audio and caching the result...")
+        result = transcribe_audio(audio_path, options, model_name, use_worker, workers)
+        TRANSCRIPTION_CACHE.put(key, result)
+
+    print("transcription cache: ", TRANSCRIPTION_CACHE.stats())
     return result["segments"]
 
-def align_script_with_audio(script_path, audio_segments):
+def split_script_line(line):
+    """
+    Script words of a line as (token, display text) pairs. The display text
+    keeps the punctuation that follows the word: "Hello, world!" ->
+    [("Hello", "Hello,"), ("world", "world!")]
+    """
+    matches = list(SCRIPT_WORD_RE.finditer(line))
+    words = []
+    for idx, match in enumerate(matches):
+        start = 0 if idx == 0 else match.start()
+        end = matches[idx + 1].start() if idx + 1 < len(matches) else len(line)
+        words.append((match.group(0), line[start:end].strip()))
+    return words
+
+
+def align_script_with_audio(script_path, audio_segments, return_score=False, script_lines=None):
     """
     Aligns the original script with the audio transcription.
-    This function reads a script from a file and aligns it with the provided audio segments.
-    It ensures that each word in the script corresponds to a word in the audio segments.
+    This function reads a script from a file and maps every script word onto a
+    transcribed word with a banded edit-distance alignment over normalized
+    tokens, so extra, missing or misheard words in the transcription only
+    affect their own neighbourhood. Script words without a transcribed
+    counterpart get timings interpolated from their neighbours.
     Args:
         script_path (str): The file path to the script.
         audio_segments (list): A list of dictionaries, where each dictionary represents an audio segment
                                and contains 'words' (a list of word dictionaries with 'word', 'start', and 'end' keys),
                                'text' (the transcribed text of the segment), 'start' (start time of the segment),
                                and 'end' (end time of the segment).
+        return_score (bool): Also return the alignment-quality score.
+        script_lines (list): The non-empty script lines when already read, the file is not opened then.
     Returns:
-        list: A list of dictionaries, where each dictionary contains:
+        list: A list of dictionaries, one per non-empty script line, where each dictionary contains:
               - 'script_line' (str): A line from the script.
               - 'words' (list): A list of word dictionaries with 'text', 'start', and 'end' keys.
               - 'start' (float): The start time of the segment.
               - 'end' (float): The end time of the segment.
-    Raises:
-        ValueError: If the number of words in the audio segments does not match the number of words in the script.
+        With return_score, a tuple (aligned_data, score) where score in [0, 1] is
+        the fraction of exactly matching words. aligned_data is None when the
+        transcription contains no words at all.
     """
-    with open(script_path, encoding="utf-8") as f:
-        script_lines = [line.strip() for line in f.readlines()]
+    if script_lines is None:
+        script_lines = read_script_lines(script_path)
     
     # converting audio_segments into list of words ####
     audio_words = []
     for segment in audio_segments:
         audio_words += segment['words']
     ######################################################
-    script = {}
-    script["script_lines"] = script_lines
-    script["script_len"] = len(script_lines)
-    script["script_line_words"] = []
-    script["script_all_words"] = []
-    for text in script_lines:
-        # text = re.sub(r'[^a-zA-Z\s]', '', text) #removing all special characters
-        script_words = re.findall(r"\b[\w]+(?:['’][\w]+)?\b", text)
-        script["script_all_words"] += script_words
-        script["script_line_words"].append(script_words)
-        # todo: change the text in every word object in segment ( later)
-
-    # checking the number of audio_words and script_lines words
-    if ( len(audio_words) == len( script['script_all_words']) ):
-        print("#########detected audio and script matched#########")
-        #iterate through every segment word and replace with script word
-        word_ind = 0
-        # audio_segments
-        for idx,segment in enumerate(audio_segments):
-            if idx >= script['script_len']:
-                audio_segments = audio_segments[0:idx]
-                break
-            
-            segment['text'] = script['script_lines'][idx]
-            segment['words'] = audio_words[
-                word_ind:len(script['script_line_words'][idx]) + word_ind
-            ]
-            word_ind += len(script['script_line_words'][idx])
-            # for seg_word in  script['script_line_words'][idx] :
-            #     seg_word = script['script_line_words'][word_ind]
-            #     word_ind+=1
-            segment['start'] = segment['words'][0]['start']
-            segment['end'] = segment['words'][-1]['end']
-        
-        
+    script_line_words = [split_script_line(line) for line in script_lines]
+    script_all_words = [word for words in script_line_words for word in words]
 
-    else:
-        print("#########Number of words in audio and script are not equal#########3")
+    if not audio_words or not script_all_words:
+        print("#########No words to align in audio or script#########")
+        print("Number of words in audio: ", len(audio_words))
+        print("Number of words in script: ", len(script_all_words))
+        return (None, 0.0) if return_score else None
+
+    mapping, score = align_tokens(
+        [normalize_token(token) for token, _ in script_all_words],
+        [normalize_token(word['word']) for word in audio_words]
+    )
+    print(f"#########script aligned with audio, quality score {score:.3f}#########")
+    if score < 1.0:
+        unmatched = [script_all_words[i][0] for i, j in enumerate(mapping) if j is None]
         print("Number of words in audio: ", len(audio_words))
-        for segment in audio_segments:
-            print(segment['text'])
-        print("Number of words in script: ", len(script['script_all_words']))
-        print(script['script_all_words'])
-        return
+        print("Number of words in script: ", len(script_all_words))
+        if unmatched:
+            print("script words not heard (timings interpolated): ", unmatched)
+
+    timings = [None if j is None else (audio_words[j]['start'], audio_words[j]['end']) for j in mapping]
+    interpolate_timings(timings)
 
     aligned_data = []
-    for idx, segment in enumerate(audio_segments):
-        if idx >= len(script_lines):
-            break
+    word_idx = 0
+    for line, line_words in zip(script_lines, script_line_words):
+        if not line_words:
+            continue
         words = []
-        for word in segment['words']:
+        for token, display in line_words:
+            j = mapping[word_idx]
+            start, end = timings[word_idx]
+            if j is not None and normalize_token(audio_words[j]['word']) == normalize_token(token):
+                # exact match: keep the transcribed text (with its leading space)
+                text = audio_words[j]['word']
+            else:
+                text = " " + display
             words.append({
-                'text': word['word'],
-                'start': word['start'],
-                'end': word['end']
+                'text': text,
+                'start': start,
+                'end': end
             })
+            word_idx += 1
         
         aligned_data.append({
-            'script_line': script_lines[idx],
+            'script_line': line,
             'words': words,
-            'start': segment['start'],
-            'end': segment['end']
+            'start': words[0]['start'],
+            'end': words[-1]['end']
         })
     
+    if return_score:
+        return aligned_data, score
     return aligned_data
 
-def process_audio(audio_path, script_path, train, background_music_path=None):
-    """Main audio processing function"""
+# --------------------------------------------------------------------
+# Transcription backends: every backend returns Whisper-like segments
+# (dicts with 'text', 'start', 'end' and 'words' of 'word', 'start', 'end')
+# for `align_script_with_audio`.
+# --------------------------------------------------------------------
+
+TRANSCRIPTION_BACKENDS = {}
+DEFAULT_BACKEND = "whisper"
+
+
+def register_backend(name):
+    """Decorator adding a `backend(audio_path, script_path, train, **options)` function"""
+    def register(func):
+        TRANSCRIPTION_BACKENDS[name] = func
+        return func
+    return register
+
+
+def read_script_lines(script_path):
+    with open(script_path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def _line_segments(script_lines, timed_words):
+    """Group (line index, word text, start, end) tuples into one segment per script line"""
+    segments = []
+    for line_idx, line in enumerate(script_lines):
+        words = [{'word': " " + word, 'start': start, 'end': end}
+                 for idx, word, start, end in timed_words if idx == line_idx]
+        if words:
+            segments.append({'text': " " + line, 'start': words[0]['start'],
+                             'end': words[-1]['end'], 'words': words})
+    return segments
+
+
+@register_backend("whisper")
+def whisper_backend(audio_path, script_path, train, use_worker=True, workers=TRANSCRIBE_WORKERS, manifest=None, **_):
+    """Open-vocabulary Whisper transcription, the script is only used for alignment"""
+    audio_digest = manifest['voiceover']['sha256'] if manifest else None
+    return transcribe_with_timestamps(audio_path, train, use_worker=use_worker, workers=workers,
+                                      audio_digest=audio_digest)
+
+
+def load_forced_aligner():
+    """torchaudio's MMS forced-alignment bundle, loaded once per process"""
+    if "mms_fa" not in _MODELS:
+        try:
+            import torch
+            import torchaudio
+        except ImportError:
+            raise ImportError("The 'forced' backend needs torchaudio (pip install torchaudio)")
+        bundle = torchaudio.pipelines.MMS_FA
+        print("loading forced alignment model ....    ")
+        with span("load_model", model="mms_fa"):
+            _MODELS["mms_fa"] = (torch, torchaudio, bundle, bundle.get_model(with_star=False),
+                                 bundle.get_tokenizer(), bundle.get_aligner())
+    return _MODELS["mms_fa"]
+
+
+@register_backend("forced")
+def forced_alignment_backend(audio_path, script_path, train, manifest=None, **_):
+    """
+    Word timings from CTC forced alignment of the known script: one pass of
+    the MMS acoustic model gives frame-level emissions, and a Viterbi search
+    over them places every script word. No decoding, so it is much cheaper
+    than Whisper. Words without any alignable letter (numbers, symbols) are
+    left out and get interpolated timings from `align_script_with_audio`.
+    """
+    if manifest:
+        script_lines = manifest['script']['lines']
+        key = make_key("forced_alignment", manifest['voiceover']['sha256'], manifest['script']['sha256'])
+    else:
+        script_lines = read_script_lines(script_path)
+        key = make_key("forced_alignment", file_digest(audio_path), file_digest(script_path))
+    if not train:
+        segments = TRANSCRIPTION_CACHE.get(key)
+        if segments is not None:
+            print("Loading cached forced alignment...")
+            return segments
+
+    torch, torchaudio, bundle, model, tokenizer, aligner = load_forced_aligner()
+    alphabet = set(bundle.get_dict())
+    words = []
+    for line_idx, line in enumerate(script_lines):
+        for token, display in split_script_line(line):
+            letters = "".join(c for c in normalize_token(token) if c in alphabet)
+            if letters:
+                words.append((line_idx, display, letters))
+    if not words:
+        return []
+
+    waveform = torch.from_numpy(whisper.load_audio(audio_path)).unsqueeze(0)
+    waveform = torchaudio.functional.resample(waveform, whisper.audio.SAMPLE_RATE, bundle.sample_rate)
+    with span("forced_alignment", words=len(words)), torch.inference_mode():
+        emission, _ = model(waveform)
+        token_spans = aligner(emission[0], tokenizer([letters for _, _, letters in words]))
+
+    seconds_per_frame = waveform.size(1) / emission.size(1) / bundle.sample_rate
+    timed_words = [(line_idx, display, spans[0].start * seconds_per_frame, spans[-1].end * seconds_per_frame)
+                   for (line_idx, display, _), spans in zip(words, token_spans)]
+    segments = _line_segments(script_lines, timed_words)
+    TRANSCRIPTION_CACHE.put(key, segments)
+    return segments
+
+
+@register_backend("stub")
+def stub_backend(audio_path, script_path, train, manifest=None, **_):
+    """
+    Deterministic offline backend: spreads the script words over the audio
+    duration in proportion to their length, with a pause after every line.
+    """
+    script_lines = manifest['script']['lines'] if manifest else read_script_lines(script_path)
+    line_words = [[display for _, display in split_script_line(line)] for line in script_lines]
+    # a word weighs its length plus one for the gap after it, a line break weighs 4
+    total = sum(sum(len(w) + 1 for w in words) + 4 for words in line_words)
+    duration = manifest['voiceover']['duration'] if manifest else audio_info(audio_path)['duration']
+    scale = duration / total if total else 0.0
+
+    timed_words = []
+    t = 0.0
+    for line_idx, words in enumerate(line_words):
+        for word in words:
+            timed_words.append((line_idx, word, round(t, 3), round(t + len(word) * scale, 3)))
+            t += (len(word) + 1) * scale
+        t += 4 * scale
+    return _line_segments(script_lines, timed_words)
+
+
+def transcribe(audio_path, script_path, train, backend=DEFAULT_BACKEND, **options):
+    """Run the transcription backend registered as `backend`"""
+    if backend not in TRANSCRIPTION_BACKENDS:
+        raise ValueError(f"Unknown transcription backend '{backend}', expected one of {sorted(TRANSCRIPTION_BACKENDS)}")
+    return TRANSCRIPTION_BACKENDS[backend](audio_path, script_path, train, **options)
+
+
+def process_audio(audio_path, script_path, train, background_music_path=None, use_worker=True,
+                  transcribe_workers=TRANSCRIBE_WORKERS, backend=DEFAULT_BACKEND, manifest=None):
+    """Main audio processing function
+    use_worker: transcribe on the resident worker when available, else load Whisper in-process
+    transcribe_workers: processes used for the silence-split chunks of long voiceovers
+    backend: name of the transcription backend, see TRANSCRIPTION_BACKENDS
+    manifest: project manifest from probe.probe_project, supplies the script
+    lines, hashes and durations instead of reading the files again
+    """
     print("Processing audio...")
-    audio_segments = transcribe_with_timestamps(audio_path, train)
-    aligned_data = align_script_with_audio(script_path, audio_segments)
+    audio_segments = transcribe(audio_path, script_path, train, backend,
+                                use_worker=use_worker, workers=transcribe_workers, manifest=manifest)
+    with span("align_script"):
+        aligned_data, alignment_score = align_script_with_audio(
+            script_path, audio_segments, return_score=True,
+            script_lines=manifest['script']['lines'] if manifest else None)
+    if aligned_data is None:
+        raise ValueError("Could not align the script with the transcribed audio")
     print("audio process is completed")
     
     result = {
         'raw_audio_path': audio_path,
-        'aligned_data': aligned_data
+        'aligned_data': aligned_data,
+        'alignment_score': alignment_score
     }
     
     if background_music_path is not None:
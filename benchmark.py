@@ -0,0 +1,242 @@
+#############################
+# benchmark.py
+#############################
+# Offline rendering benchmark. Builds synthetic projects in the input/ layout
+# (numbered images, voiceover and background audio, script.txt), transcribes
+# them with the deterministic "stub" backend instead of Whisper and times every stage:
+# alignment, create_subtitles, frame composition and encode.
+#
+#   python benchmark.py --sizes small medium --output outputs/benchmark.json
+#
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import tempfile
+import time
+import wave
+
+import numpy as np
+from PIL import Image
+
+from audio_processor import align_script_with_audio, transcribe
+from encoder import encode_frames, encoder_profile
+from span_renderer import StaticSpanRenderer, change_points
+from sprite_cache import SPRITE_CACHE
+from subtitle_overlay import create_subtitle_overlay
+from utils import list_images, validate_inputs
+from video_processor import base_frame, create_image_clips
+
+BENCHMARK_SIZES = {
+    # name: (script lines, words per line)
+    'small': (4, 8),
+    'medium': (12, 12),
+    'long': (40, 14),
+}
+
+VOCABULARY = (
+    "the king and his brother walked into the forest where an old sage "
+    "told them a story about courage honour and the price of every promise "
+    "they had made before the great war began between the two families"
+).split()
+
+SAMPLE_RATE = 22050
+WORD_GAP = 0.05
+LINE_GAP = 0.3
+
+
+def _word_duration(word):
+    return 0.12 + 0.05 * len(word)
+
+
+def _write_wav(path, samples):
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes((np.clip(samples, -1, 1) * 32767).astype(np.int16).tobytes())
+
+
+def make_project(root, n_lines, words_per_line, size=(540, 960), seed=0):
+    """
+    Create a synthetic project directory under `root` and return its path.
+    The voiceover contains a tone burst for every word, separated by short
+    silences, the background is low noise-modulated music-like tone.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(os.path.join(root, "images"), exist_ok=True)
+    os.makedirs(os.path.join(root, "audio"), exist_ok=True)
+
+    lines = []
+    for line_idx in range(n_lines):
+        words = [VOCABULARY[(line_idx * words_per_line + k * 7) % len(VOCABULARY)] for k in range(words_per_line)]
+        words[0] = words[0].capitalize()
+        lines.append(" ".join(words) + ".")
+    with open(os.path.join(root, "script.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
+
+    w, h = size
+    yy, xx = np.mgrid[0:h, 0:w]
+    for line_idx in range(n_lines):
+        base = rng.integers(0, 256, 3)
+        img = np.empty((h, w, 3), dtype=np.uint8)
+        for c in range(3):
+            img[..., c] = (base[c] + xx * (c + 1) // 4 + yy // (c + 2)) % 256
+        noise = rng.integers(0, 24, (h, w, 3), dtype=np.uint8)
+        Image.fromarray(img + noise).save(os.path.join(root, "images", f"{line_idx + 1}.png"))
+
+    voice = [np.zeros(int(0.2 * SAMPLE_RATE))]
+    for line in lines:
+        for word in line.split():
+            n = int(_word_duration(word) * SAMPLE_RATE)
+            t = np.arange(n) / SAMPLE_RATE
+            envelope = np.sin(np.pi * np.arange(n) / n)
+            voice.append(0.4 * envelope * np.sin(2 * np.pi * 180 * t) + 0.05 * envelope * rng.standard_normal(n))
+            voice.append(np.zeros(int(WORD_GAP * SAMPLE_RATE)))
+        voice.append(np.zeros(int(LINE_GAP * SAMPLE_RATE)))
+    voice = np.concatenate(voice)
+    _write_wav(os.path.join(root, "audio", "voiceover.wav"), voice)
+
+    n = int(len(voice) * 0.6)
+    t = np.arange(n) / SAMPLE_RATE
+    background = 0.2 * np.sin(2 * np.pi * 110 * t) * (0.6 + 0.4 * np.sin(2 * np.pi * 0.5 * t))
+    _write_wav(os.path.join(root, "audio", "background.wav"), background)
+    return root
+
+
+def _best_of(repeats, func):
+    """Run `func` `repeats` times, return (best seconds, last result)"""
+    best, result = None, None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def benchmark_project(project_dir, resolution, sub_position=60, playback_speed=1.0, repeats=3, encoder=None):
+    """Time every rendering stage of one project, returns a dict of results"""
+    encoder = encoder or encoder_profile()
+    imgs_dir, voice_path, _, script_path = validate_inputs(project_dir)
+    segments = transcribe(voice_path, script_path, 0, backend="stub")
+
+    align_s, aligned_data = _best_of(repeats, lambda: align_script_with_audio(script_path, segments))
+
+    def subtitles_cold():
+        SPRITE_CACHE.clear()
+        return create_subtitle_overlay(aligned_data, resolution[1], sub_position)
+
+    subtitles_s, overlay = _best_of(repeats, subtitles_cold)
+    subtitles_warm_s, overlay = _best_of(
+        repeats, lambda: create_subtitle_overlay(aligned_data, resolution[1], sub_position)
+    )
+
+    video_clip = create_image_clips(list_images(imgs_dir), aligned_data, resolution)
+    timeline = max(video_clip.duration, overlay.end)
+    fps = encoder['fps']
+    n_frames = int(timeline / playback_speed * fps)
+
+    def new_renderer():
+        return StaticSpanRenderer(
+            lambda t: overlay.render(base_frame(video_clip, resolution, t), t),
+            change_points(video_clip, overlay)
+        )
+
+    def frames(renderer):
+        for frame_index in range(n_frames):
+            yield renderer.get_frame(frame_index / fps * playback_speed)
+
+    def compose():
+        renderer = new_renderer()
+        for _ in frames(renderer):
+            pass
+        return renderer.stats()
+
+    compose_s, compose_stats = _best_of(repeats, compose)
+
+    out_dir = tempfile.mkdtemp(prefix="shortgen_bench_")
+    try:
+        output = os.path.join(out_dir, "bench.mp4")
+        render_s, encode_stats = _best_of(
+            repeats, lambda: encode_frames(frames(new_renderer()), resolution, output, encoder)
+        )
+    finally:
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+    return {
+        'words': sum(len(seg['words']) for seg in aligned_data),
+        'timeline_seconds': timeline,
+        'frames': n_frames,
+        'composed_frames': compose_stats['composed'],
+        'stages': {
+            'alignment': align_s,
+            'create_subtitles': subtitles_s,
+            'create_subtitles_warm': subtitles_warm_s,
+            'frame_composition': compose_s,
+            'render': render_s,
+            'encode': max(0.0, render_s - compose_s),
+        },
+        'encode_fps': encode_stats['fps'],
+        'output_bytes': encode_stats['bytes'],
+    }
+
+
+def _git_commit():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(sizes, resolution, repeats=3, encoder=None, keep_projects=None):
+    """Benchmark every size in `sizes`, returns the results dict"""
+    results = {
+        'commit': _git_commit(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'resolution': list(resolution),
+        'repeats': repeats,
+        'sizes': {},
+    }
+    root = keep_projects or tempfile.mkdtemp(prefix="shortgen_projects_")
+    try:
+        for name in sizes:
+            n_lines, words_per_line = BENCHMARK_SIZES[name]
+            project = make_project(os.path.join(root, name), n_lines, words_per_line, resolution)
+            print(f"benchmarking {name} ({n_lines} lines x {words_per_line} words)...")
+            results['sizes'][name] = benchmark_project(project, resolution, repeats=repeats, encoder=encoder)
+            stages = results['sizes'][name]['stages']
+            print("   " + "  ".join(f"{stage}={seconds:.3f}s" for stage, seconds in stages.items()))
+    finally:
+        if keep_projects is None:
+            shutil.rmtree(root, ignore_errors=True)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline Short_gen rendering benchmark')
+    parser.add_argument('--sizes', type=str, nargs='+', default=list(BENCHMARK_SIZES), choices=list(BENCHMARK_SIZES))
+    parser.add_argument('--resolution', type=str, default="540x960", help='Canvas size WIDTHxHEIGHT')
+    parser.add_argument('--repeats', type=int, default=3, help='Runs per stage, the best time is kept')
+    parser.add_argument('--preset', type=str, default=None, help='x264 preset for the encode stage')
+    parser.add_argument('--keep_projects', type=str, default=None, help='Write the synthetic projects here and keep them')
+    parser.add_argument('--output', type=str, default='outputs/benchmark.json', help='Results JSON path')
+    args = parser.parse_args()
+
+    width, height = (int(v) for v in args.resolution.lower().split("x"))
+    results = run_benchmarks(args.sizes, (width, height), args.repeats,
+                             encoder_profile(preset=args.preset), args.keep_projects)
+
+    os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print(f"results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
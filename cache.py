@@ -0,0 +1,152 @@
+#############################
+# cache.py
+#############################
+import errno
+import hashlib
+import json
+import os
+import pickle
+import shutil
+
+from filelock import FileLock
+
+from workspace import atomic_write
+
+CACHE_ROOT = "temp/cache"
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """Return the sha256 hex digest of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_key(*parts):
+    """Hash any JSON-serialisable parts into a stable cache key"""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class DiskCache:
+    """
+    Multi-entry pickle cache on disk.
+    Every entry is stored as `<key><suffix>` inside `directory`. The file mtime
+    is refreshed on every hit, so evicting the oldest mtimes first gives LRU
+    order. Entries are evicted until the total size fits in `max_bytes`.
+    Besides pickled values, whole files can be cached with `put_file` and
+    looked up with `get_path`.
+    The directory can be shared by concurrent jobs: entries are written to a
+    temporary file and renamed into place, and eviction holds a file lock.
+    """
+
+    def __init__(self, directory, max_bytes=512 * 1024 * 1024, suffix=".pkl"):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}{self.suffix}")
+
+    def _lock(self):
+        os.makedirs(self.directory, exist_ok=True)
+        return FileLock(os.path.join(self.directory, ".lock"))
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def get(self, key, default=None):
+        """Return the cached value for `key` or `default` on a miss"""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.misses += 1
+            return default
+        try:
+            os.utime(path)
+        except OSError:
+            pass  # evicted by another job meanwhile, the value is still good
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """Store `value` under `key` and evict old entries if over budget"""
+        with atomic_write(self._path(key)) as f:
+            pickle.dump(value, f)
+        self.evict()
+
+    def get_path(self, key):
+        """Path of the cached file for `key`, None on a miss"""
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except OSError:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def put_file(self, key, src_path, evict=True):
+        """Move the file at `src_path` into the cache under `key`, returns its new path"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        try:
+            os.replace(src_path, path)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # the source is on another filesystem (e.g. a tmpfs workspace)
+            with atomic_write(path) as f, open(src_path, "rb") as src:
+                shutil.copyfileobj(src, f)
+            os.remove(src_path)
+        if evict:
+            self.evict()
+        return path
+
+    def entries(self):
+        """Return (path, size, mtime) for every entry, oldest first"""
+        if not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for f in os.listdir(self.directory):
+            if not f.endswith(self.suffix):
+                continue
+            path = os.path.join(self.directory, f)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            entries.append((path, st.st_size, st.st_mtime))
+        return sorted(entries, key=lambda e: e[2])
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits `max_bytes`"""
+        with self._lock():
+            entries = self.entries()
+            total = sum(size for _, size, _ in entries)
+            for path, size, _ in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+
+    def stats(self):
+        """Return hit/miss counters together with the current disk usage"""
+        entries = self.entries()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+        }
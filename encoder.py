@@ -0,0 +1,190 @@
+#############################
+# encoder.py
+#############################
+# Streams raw RGB24 frames straight into an ffmpeg subprocess instead of
+# going through moviepy's write_videofile. Extra renditions (other sizes or
+# bitrates) are split off the same frame stream inside that one ffmpeg process.
+import os
+import subprocess
+import time
+
+import numpy as np
+
+DEFAULT_ENCODER_PROFILE = {
+    'fps': 24,
+    'codec': 'libx264',
+    'crf': 23,
+    'bitrate': None,       # e.g. "2M", target bitrate used instead of crf
+    'preset': 'fast',
+    'tune': None,          # e.g. "stillimage" for slideshow-like shorts
+    'threads': 4,
+    'gop': None,           # keyframe interval in frames, None = encoder default
+    'pix_fmt': 'yuv420p',
+    'audio_codec': 'aac',
+}
+
+
+def encoder_profile(**overrides):
+    """Default encoder profile updated with the non-None `overrides`"""
+    profile = dict(DEFAULT_ENCODER_PROFILE)
+    for key, value in overrides.items():
+        if key not in profile:
+            raise ValueError(f"Unknown encoder option: {key}")
+        if value is not None:
+            profile[key] = value
+    return profile
+
+
+def check_frame_size(width, height, what="resolution"):
+    """Raise ValueError unless width and height are positive and even (yuv420p halves both for chroma)"""
+    if width <= 0 or height <= 0 or width % 2 or height % 2:
+        raise ValueError(f"Invalid {what} {width}x{height}, expected positive even numbers")
+
+
+def rendition(size, output=None, **encoder_overrides):
+    """
+    Extra output of a render: the frames scaled (and center-cropped if the
+    aspect ratio differs) to `size`, encoded with the main encoder profile
+    updated with `encoder_overrides` (e.g. crf=26 or bitrate="2M").
+    output: path of the file, None names it after the main output (see rendition_path)
+    """
+    width, height = (int(v) for v in size)
+    check_frame_size(width, height, "rendition size")
+    encoder_profile(**encoder_overrides)
+    return {'size': (width, height), 'output': output, 'encoder': encoder_overrides}
+
+
+def parse_rendition(value):
+    """'720x1280' or '720x1280:crf=26,preset=slow' -> rendition dict"""
+    size, _, options = value.partition(":")
+    try:
+        width, height = (int(v) for v in size.lower().split("x"))
+    except ValueError:
+        raise ValueError(f"Invalid rendition '{value}', expected WIDTHxHEIGHT[:option=value,...]")
+    overrides = {}
+    for option in filter(None, options.split(",")):
+        key, sep, raw = option.partition("=")
+        if not sep:
+            raise ValueError(f"Invalid rendition option '{option}', expected option=value")
+        overrides[key] = int(raw) if key in ('crf', 'fps', 'threads', 'gop') else raw
+    if 'fps' in overrides:
+        raise ValueError("Renditions share the frame rate of the main output")
+    return rendition((width, height), **overrides)
+
+
+def rendition_path(output_path, size):
+    """'outputs/video.mp4', (720, 1280) -> 'outputs/video_720x1280.mp4'"""
+    base, ext = os.path.splitext(output_path)
+    return f"{base}_{size[0]}x{size[1]}{ext or '.mp4'}"
+
+
+def _video_codec_args(profile):
+    args = ["-c:v", profile['codec'], "-preset", profile['preset']]
+    if profile['bitrate']:
+        args += ["-b:v", str(profile['bitrate'])]
+    else:
+        args += ["-crf", str(profile['crf'])]
+    if profile['tune']:
+        args += ["-tune", profile['tune']]
+    if profile['gop']:
+        args += ["-g", str(profile['gop'])]
+    return args + ["-threads", str(profile['threads']), "-pix_fmt", profile['pix_fmt']]
+
+
+def _rendition_graph(video_filter, renditions):
+    """filter_complex feeding [v0] (main output) and [v1].. (scaled renditions) from one input"""
+    head = f"[0:v]{video_filter + ',' if video_filter else ''}split={len(renditions) + 1}"
+    head += "".join(f"[s{i}]" for i in range(len(renditions) + 1))
+    chains = [head, "[s0]null[v0]"]
+    for i, item in enumerate(renditions, 1):
+        w, h = item['size']
+        chains.append(f"[s{i}]scale={w}:{h}:force_original_aspect_ratio=increase:flags=lanczos,"
+                      f"crop={w}:{h},setsar=1[v{i}]")
+    return ";".join(chains)
+
+
+def ffmpeg_command(size, output_path, profile, audio_path=None, video_filter=None, renditions=None):
+    """ffmpeg command line reading rgb24 frames of `size` from stdin
+    video_filter: ffmpeg filter chain applied to the frames before encoding
+    renditions: extra outputs (see `rendition`, `output` must be set) encoded
+    from the same frames through a split/scale filtergraph
+    """
+    w, h = size
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error",
+        "-f", "rawvideo", "-pix_fmt", "rgb24",
+        "-s", f"{w}x{h}", "-r", str(profile['fps']),
+        "-i", "-",
+    ]
+    if renditions:
+        if audio_path is not None:
+            cmd += ["-i", audio_path]
+        cmd += ["-filter_complex", _rendition_graph(video_filter, renditions)]
+        outputs = [(output_path, profile)] + [(item['output'], dict(profile, **item['encoder']))
+                                              for item in renditions]
+        for i, (path, output_profile) in enumerate(outputs):
+            cmd += ["-map", f"[v{i}]"]
+            if audio_path is not None:
+                cmd += ["-map", "1:a", "-c:a", output_profile['audio_codec']]
+            else:
+                cmd += ["-an"]
+            cmd += _video_codec_args(output_profile) + [path]
+        return cmd
+
+    if audio_path is not None:
+        cmd += ["-i", audio_path, "-map", "0:v", "-map", "1:a", "-c:a", profile['audio_codec']]
+    else:
+        cmd += ["-an"]
+
+    if video_filter:
+        cmd += ["-vf", video_filter]
+    return cmd + _video_codec_args(profile) + [output_path]
+
+
+def encode_frames(frames, size, output_path, profile=None, audio_path=None, video_filter=None, renditions=None):
+    """
+    Encode an iterable of (h, w, 3) uint8 frames into `output_path`, and into
+    every rendition (see `ffmpeg_command`) in the same pass.
+    Contiguous frames are written to ffmpeg's stdin without a copy; anything
+    else is copied into one reusable buffer first.
+    Returns encode statistics: frames, seconds, fps and bytes written, plus
+    the output path and bytes of every rendition.
+    """
+    profile = profile or encoder_profile()
+    w, h = size
+    buffer = np.empty((h, w, 3), dtype=np.uint8)
+
+    start = time.perf_counter()
+    for item in renditions or []:
+        os.makedirs(os.path.dirname(item['output']) or ".", exist_ok=True)
+    proc = subprocess.Popen(ffmpeg_command(size, output_path, profile, audio_path, video_filter, renditions),
+                            stdin=subprocess.PIPE, stderr=subprocess.PIPE)
+    n_frames = 0
+    try:
+        for frame in frames:
+            if frame.shape != buffer.shape:
+                raise ValueError(f"Frame of shape {frame.shape} does not match the encoder size {w}x{h}")
+            if frame.dtype != np.uint8 or not frame.flags.c_contiguous:
+                np.copyto(buffer, frame, casting='unsafe')
+                frame = buffer
+            proc.stdin.write(memoryview(frame).cast("B"))
+            n_frames += 1
+    except BrokenPipeError:
+        pass
+    finally:
+        proc.stdin.close()
+        stderr = proc.stderr.read().decode(errors="replace")
+        proc.wait()
+
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed ({proc.returncode}): {stderr.strip()}")
+
+    seconds = time.perf_counter() - start
+    return {
+        'frames': n_frames,
+        'seconds': seconds,
+        'fps': n_frames / seconds if seconds > 0 else 0.0,
+        'bytes': os.path.getsize(output_path),
+        'renditions': [{'output': item['output'], 'size': item['size'],
+                        'bytes': os.path.getsize(item['output'])} for item in renditions or []],
+    }
@@ -0,0 +1,48 @@
+#############################
+# font_metrics.py
+#############################
+# Word sizes straight from the font metrics, without rasterizing anything.
+# The numbers are exactly the size of the TextClip moviepy would render
+# (method="label"): the multiline bbox with a left-middle anchor, including
+# the stroke, with moviepy's default interline of 4.
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+
+TEXTCLIP_INTERLINE = 4
+
+_DRAW = ImageDraw.Draw(Image.new("RGB", (1, 1)))
+
+
+@lru_cache(maxsize=None)
+def load_font(font, font_size):
+    """PIL FreeType font, opened once per (file, size)"""
+    return ImageFont.truetype(font, font_size)
+
+
+class FontMetrics:
+    """Text measurements for one (font, size, stroke width), memoized per text"""
+
+    def __init__(self, font, font_size, stroke_width=0):
+        self.font = font
+        self.font_size = font_size
+        self.stroke_width = stroke_width
+        self._pil_font = load_font(font, font_size)
+        self._sizes = {}
+
+    def text_size(self, text):
+        """(width, height) in pixels of `text` rendered as a TextClip"""
+        size = self._sizes.get(text)
+        if size is None:
+            left, top, right, bottom = _DRAW.multiline_textbbox(
+                (0, 0), text, font=self._pil_font, spacing=TEXTCLIP_INTERLINE,
+                align="left", stroke_width=self.stroke_width, anchor="lm",
+            )
+            size = self._sizes[text] = (int(right - left), int(bottom - top))
+        return size
+
+
+@lru_cache(maxsize=None)
+def font_metrics(font, font_size, stroke_width=0):
+    """Shared FontMetrics for (font, font_size, stroke_width)"""
+    return FontMetrics(font, font_size, stroke_width)
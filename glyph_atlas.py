@@ -0,0 +1,232 @@
+#############################
+# glyph_atlas.py
+#############################
+# Word sprites composed from pre-rasterized glyphs instead of rendering every
+# word through a TextClip. Each glyph is rasterized once per (font, size,
+# stroke width, sub-pixel phase) into a coverage mask; a word is the glyph
+# masks blitted at their kerned pen positions and colored with numpy.
+# The result is pixel-identical to the TextClip sprite (see `parity_check`).
+import argparse
+import math
+
+import numpy as np
+from PIL import ImageColor
+from moviepy.video.VideoClip import TextClip
+
+from font_metrics import font_metrics, load_font
+
+
+def _mul_div255(a, b):
+    """a * b / 255 with PIL's integer rounding"""
+    tmp = a * b + 128
+    return ((tmp >> 8) + tmp) >> 8
+
+
+def _ink(color):
+    return np.array(ImageColor.getcolor(color, "RGBA"), dtype=np.int32)
+
+
+class GlyphAtlas:
+    """
+    Glyph coverage masks and kerning of one (font, size, stroke width).
+    Masks do not depend on colors, so every style drawn with the same font,
+    size and stroke shares the atlas. Glyphs are rasterized on first use and
+    kept for the life of the process.
+    """
+
+    def __init__(self, font, font_size, stroke_width=0):
+        self.font = font
+        self.font_size = font_size
+        self.stroke_width = stroke_width
+        self.metrics = font_metrics(font, font_size, stroke_width)
+        self._pil_font = load_font(font, font_size)
+        self._glyphs = {}
+        self._advances = {}
+        self._kerning = {}
+
+    def __len__(self):
+        return len(self._glyphs)
+
+    def glyph(self, char, phase_x, phase_y, stroke_width):
+        """(coverage, (dx, dy)) of `char` drawn at a sub-pixel phase, anchored left-middle"""
+        key = (char, phase_x, phase_y, stroke_width)
+        glyph = self._glyphs.get(key)
+        if glyph is None:
+            mask, offset = self._pil_font.getmask2(
+                char, "L", stroke_width=stroke_width, anchor="lm", start=(phase_x, phase_y)
+            )
+            width, height = mask.size
+            coverage = np.array(mask, dtype=np.int32).reshape(height, width)
+            glyph = self._glyphs[key] = (coverage, offset)
+        return glyph
+
+    def advance(self, char):
+        advance = self._advances.get(char)
+        if advance is None:
+            advance = self._advances[char] = self._pil_font.getlength(char)
+        return advance
+
+    def kerning(self, left, right):
+        pair = left + right
+        kern = self._kerning.get(pair)
+        if kern is None:
+            kern = self._kerning[pair] = (self._pil_font.getlength(pair)
+                                          - self.advance(left) - self.advance(right))
+        return kern
+
+    def pen_positions(self, text):
+        """x of every character's origin, advances plus pair kerning"""
+        pens = []
+        pen = 0.0
+        for i, char in enumerate(text):
+            if i:
+                pen += self.advance(text[i - 1]) + self.kerning(text[i - 1], char)
+            pens.append(pen)
+        return pens
+
+    def coverage(self, text, size, stroke_width=0):
+        """
+        Coverage mask (h, w) of `text` on a canvas of `size`, laid out like
+        PIL draws it: origin at the left-middle of the canvas, overlapping
+        glyphs merged with the "over" operator.
+        """
+        w, h = size
+        y = h / 2
+        base_y, phase_y = int(y), y - int(y)
+        canvas = np.zeros((h, w), dtype=np.int32)
+        for char, pen in zip(text, self.pen_positions(text)):
+            px = math.floor(pen)
+            mask, (dx, dy) = self.glyph(char, pen - px, phase_y, stroke_width)
+            x0, y0 = px + dx, base_y + dy
+            gh, gw = mask.shape
+            cx0, cy0 = max(x0, 0), max(y0, 0)
+            cx1, cy1 = min(x0 + gw, w), min(y0 + gh, h)
+            if cx1 <= cx0 or cy1 <= cy0:
+                continue
+            src = mask[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0]
+            dst = canvas[cy0:cy1, cx0:cx1]
+            dst += _mul_div255(src, 255 - dst)
+        return canvas
+
+    def render(self, text, color, stroke_color, bg_color):
+        """RGBA sprite of `text`, same pixels as `textclip_rgba` for this font, size and stroke"""
+        size = self.metrics.text_size(text)
+        w, h = size
+        bg = (0, 0, 0, 0) if bg_color is None else ImageColor.getcolor(bg_color, "RGBA")
+        rgba = np.empty((h, w, 4), dtype=np.int32)
+        rgba[:] = bg
+        # Stroke first, then the fill on top, as ImageDraw.text does
+        if stroke_color is not None and self.stroke_width:
+            _fill_mask(rgba, self.coverage(text, size, self.stroke_width), _ink(stroke_color))
+        _fill_mask(rgba, self.coverage(text, size), _ink(color))
+        # TextClip keeps the alpha as a float mask, round-trip it the same way
+        rgba[..., 3] = (1.0 * rgba[..., 3] / 255 * 255).astype(np.uint8)
+        return rgba.astype(np.uint8)
+
+
+def _fill_mask(rgba, coverage, ink):
+    """
+    Blend a solid `ink` into `rgba` in place through `coverage`, like PIL's
+    fill: over fully transparent pixels the color bands take the ink outright.
+    """
+    a = np.repeat(coverage[..., None], 4, axis=2)
+    a[..., :3] = np.where((coverage[..., None] != 0) & (rgba[..., 3:] == 0), 255, a[..., :3])
+    tmp = rgba * (255 - a) + ink * a + 128
+    rgba[:] = ((tmp >> 8) + tmp) >> 8
+
+
+# One atlas per (font, size, stroke width) and process
+_ATLASES = {}
+
+
+def glyph_atlas(font, font_size, stroke_width=0):
+    """Shared GlyphAtlas for (font, font_size, stroke_width)"""
+    key = (font, font_size, stroke_width)
+    atlas = _ATLASES.get(key)
+    if atlas is None:
+        atlas = _ATLASES[key] = GlyphAtlas(font, font_size, stroke_width)
+    return atlas
+
+
+def textclip_rgba(text, font, font_size, color, stroke_color, stroke_width, bg_color):
+    """RGBA array of the word rendered by moviepy's TextClip (the reference renderer)"""
+    clip = TextClip(
+        text=text,
+        font=font,
+        font_size=font_size,
+        color=color,
+        stroke_color=stroke_color,
+        stroke_width=stroke_width,
+        bg_color=bg_color
+        # method="label"
+    )
+    rgb = clip.get_frame(0).astype(np.uint8)
+    if clip.mask is None:
+        alpha = np.full(rgb.shape[:2], 255, dtype=np.uint8)
+    else:
+        alpha = (clip.mask.get_frame(0) * 255).astype(np.uint8)
+    return np.dstack([rgb, alpha])
+
+
+def word_rgba(text, font, font_size, color, stroke_color, stroke_width, bg_color):
+    """
+    RGBA sprite of a subtitle word. Single-line text is composed from the glyph
+    atlas; multi-line text goes through TextClip.
+    """
+    if not text or "\n" in text:
+        return textclip_rgba(text, font, font_size, color, stroke_color, stroke_width, bg_color)
+    return glyph_atlas(font, font_size, stroke_width).render(text, color, stroke_color, bg_color)
+
+
+def parity_check(words, styles):
+    """
+    Compare the atlas and TextClip sprites of every word in every style
+    (tuples of font, font_size, color, stroke_color, stroke_width, bg_color).
+    Returns a list of (word, style, differing pixels, max channel difference).
+    """
+    mismatches = []
+    for style in styles:
+        font, font_size, color, stroke_color, stroke_width, bg_color = style
+        for word in words:
+            expected = textclip_rgba(word, font, font_size, color, stroke_color, stroke_width, bg_color)
+            actual = word_rgba(word, font, font_size, color, stroke_color, stroke_width, bg_color)
+            if expected.shape != actual.shape:
+                mismatches.append((word, style, expected.shape[0] * expected.shape[1], None))
+                continue
+            diff = np.abs(expected.astype(np.int16) - actual.astype(np.int16))
+            if diff.any():
+                mismatches.append((word, style, int(diff.any(axis=2).sum()), int(diff.max())))
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check glyph atlas sprites against TextClip")
+    parser.add_argument("--script", help="Text file whose words are checked (default: a built-in sample)")
+    parser.add_argument("--fonts", nargs="+", default=["fonts/Arial-bold.otf"])
+    parser.add_argument("--sizes", nargs="+", type=int, default=[42, 45])
+    parser.add_argument("--stroke_width", type=int, default=2)
+    args = parser.parse_args()
+
+    if args.script:
+        with open(args.script, "r", encoding="utf-8") as f:
+            words = sorted(set(f.read().split()))
+    else:
+        words = ("The quick brown fox jumps over a lazy dog. AVATAR Wave, Toyota's "
+                 "\"field\" 1984! Krishna (Arjuna) - 50% off?").split()
+
+    styles = []
+    for font in args.fonts:
+        for size in args.sizes:
+            styles.append((font, size, "white", "black", args.stroke_width, "#0e0f0e"))
+            styles.append((font, size, "#42a884", "black", args.stroke_width, "#0e0f0e"))
+            styles.append((font, size, "white", None, 0, None))
+
+    mismatches = parity_check(words, styles)
+    for word, style, pixels, max_diff in mismatches:
+        print(f"mismatch {word!r} {style}: {pixels} pixels, max difference {max_diff}")
+    print(f"{len(words) * len(styles) - len(mismatches)}/{len(words) * len(styles)} sprites identical")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,101 @@
+#############################
+# image_cache.py
+#############################
+# Decodes every project image once, fits it to the output canvas and keeps
+# the result as a .npy file in a content-addressed cache. Frames are then
+# memory-mapped, so repeated renders never decode or resize again. The cache
+# is size-bounded and evicts the least recently used frames.
+import os
+import tempfile
+
+import numpy as np
+from PIL import Image
+
+from cache import CACHE_ROOT, DiskCache, file_digest, make_key
+
+# a 1080x1920 frame is ~6 MB
+IMAGE_CACHE = DiskCache(os.path.join(CACHE_ROOT, "images"), max_bytes=2 * 1024 * 1024 * 1024, suffix=".npy")
+FIT_POLICIES = ("crop", "letterbox", "stretch")
+
+
+def image_size(path):
+    """(width, height) read from the image header, without decoding pixels"""
+    with Image.open(path) as img:
+        return img.size
+
+
+def to_rgb(img):
+    """RGB copy of `img`, transparent images are laid over black"""
+    if img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info):
+        img = img.convert("RGBA")
+        canvas = Image.new("RGB", img.size, (0, 0, 0))
+        canvas.paste(img, (0, 0), img.getchannel("A"))
+        return canvas
+    return img.convert("RGB")
+
+
+def fit_image(img, size, fit="crop"):
+    """
+    Fit a PIL image to `size` (width, height).
+    crop: scale to cover the canvas and cut the overflow evenly on both sides
+    letterbox: scale to fit inside the canvas and pad with black
+    stretch: resize to the canvas ignoring the aspect ratio
+    """
+    if fit not in FIT_POLICIES:
+        raise ValueError(f"Unknown fit policy '{fit}', expected one of {FIT_POLICIES}")
+    img = to_rgb(img)
+    w, h = size
+    if img.size == (w, h):
+        return img
+
+    if fit == "stretch":
+        return img.resize((w, h), Image.LANCZOS)
+
+    iw, ih = img.size
+    if fit == "crop":
+        scale = max(w / iw, h / ih)
+    else:
+        scale = min(w / iw, h / ih)
+    sw, sh = max(1, round(iw * scale)), max(1, round(ih * scale))
+    img = img.resize((sw, sh), Image.LANCZOS)
+
+    if fit == "crop":
+        left, top = (sw - w) // 2, (sh - h) // 2
+        return img.crop((left, top, left + w, top + h))
+
+    canvas = Image.new("RGB", (w, h), (0, 0, 0))
+    canvas.paste(img, ((w - sw) // 2, (h - sh) // 2))
+    return canvas
+
+
+def prepare_image(path, size, fit="crop", cache=IMAGE_CACHE, digest=None):
+    """
+    Return the image at `path` fitted to `size` as a read-only memory-mapped
+    (height, width, 3) uint8 array. The cache key is the image content plus
+    the target size and fit policy.
+    digest: sha256 of the file when already known, saves hashing it again
+    """
+    key = make_key("image", digest or file_digest(path), list(size), fit)
+    cached = cache.get_path(key)
+    if cached is None:
+        with Image.open(path) as img:
+            frame = np.ascontiguousarray(np.array(fit_image(img, size, fit), dtype=np.uint8))
+        # written next to the entries so put_file is an atomic rename
+        os.makedirs(cache.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.save(f, frame)
+            cached = cache.put_file(key, tmp_path)
+        except BaseException:
+            # e.g. a full disk or an interrupt, don't leave the partial file behind
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+    return np.load(cached, mmap_mode="r")
+
+
+def prepare_images(paths, size, fit="crop", cache=IMAGE_CACHE, digests=None):
+    """`prepare_image` for every path, in order"""
+    digests = digests or [None] * len(paths)
+    return [prepare_image(path, size, fit, cache, digest) for path, digest in zip(paths, digests)]
@@ -2,10 +2,219 @@
 # main.py (Entry Point)
 #############################
 import argparse
-from video_processor import process_video
-from audio_processor import process_audio
-from utils import validate_inputs, check_audio_duration
+import glob
+import json
 import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from video_processor import SUBTITLE_RENDERERS, process_video
+from audio_mix import ducking_profile
+from encoder import check_frame_size, encoder_profile, parse_rendition
+from audio_processor import DEFAULT_BACKEND, TRANSCRIBE_WORKERS, TRANSCRIPTION_BACKENDS, process_audio
+from probe import probe_project
+from tracing import TRACER, span
+
+
+def prepare_job(input_dir, train, transcribe_workers=TRANSCRIBE_WORKERS, backend=DEFAULT_BACKEND):
+    """Validate one project directory and run its audio stage.
+    Returns the arguments `render_job` needs to render the project.
+    transcribe_workers: processes for the silence-split chunks of long voiceovers
+    backend: transcription backend ("whisper", "forced" or "stub")
+    """
+    # One probe gives every later stage its file lists, hashes and durations
+    with span("probe_project"):
+        manifest = probe_project(input_dir)
+    imgs_dir = manifest['image_dir']
+    script_dir = manifest['script']['path']
+    foreaudio_dir = manifest['voiceover']['path']
+    backauido_dir = manifest['background']['path'] if manifest['background'] else None
+
+    audio_duration = manifest['voiceover']['duration']
+    if audio_duration > 40:
+        print("Warning: Audio exceeds 40 seconds - platform limits may apply")
+    
+    # Compare the number of images with the number of lines in script
+    num_images = len(manifest['images'])
+    num_lines = len(manifest['script']['lines'])
+        
+    if num_images < num_lines:
+        raise ValueError(f"Not enough images ({num_images}) for script lines ({num_lines}). Each line needs a corresponding image.")
+    elif num_images > num_lines:
+        raise ValueError(f"Warning: More images ({num_images}) than script lines ({num_lines}). Extra images will be ignored.")
+
+    with span("process_audio"):
+        processed_audio = process_audio(foreaudio_dir, script_dir, train, backauido_dir,
+                                        transcribe_workers=transcribe_workers, backend=backend,
+                                        manifest=manifest)
+    return {
+        'imgs_dir': imgs_dir,
+        'script_dir': script_dir,
+        'processed_audio': processed_audio,
+        'manifest': manifest,
+    }
+
+
+def render_job(prepared, output_path, sub_pos, pbspeed, **video_options):
+    """Render a project prepared by `prepare_job`
+    video_options: extra keyword arguments for `process_video` (encoder, resolution, fit, ...)
+    """
+    with span("process_video"):
+        process_video(prepared['imgs_dir'], prepared['script_dir'], prepared['processed_audio'],
+                     output_path, sub_pos, pbspeed, background_volume=0.3,
+                     manifest=prepared.get('manifest'), **video_options)
+    return output_path
+
+
+def _timed(func, *args, **kwargs):
+    """Run `func` in a pool worker, returns (result, seconds, trace events of the job)"""
+    TRACER.drain()
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start, TRACER.drain()
+
+
+def parse_resolution(value):
+    """'1080x1920' -> (1080, 1920), None stays None"""
+    if value is None:
+        return None
+    try:
+        width, height = (int(v) for v in value.lower().split("x"))
+    except ValueError:
+        raise ValueError(f"Invalid resolution '{value}', expected WIDTHxHEIGHT")
+    check_frame_size(width, height)
+    return (width, height)
+
+
+def parse_time_range(value):
+    """'2.5-8' -> (2.5, 8.0), None stays None"""
+    if value is None:
+        return None
+    try:
+        start, end = (float(v) for v in value.split("-"))
+    except ValueError:
+        raise ValueError(f"Invalid time range '{value}', expected START-END in seconds")
+    if end <= start:
+        raise ValueError(f"Invalid time range '{value}', END must be after START")
+    return (start, end)
+
+
+def expand_projects(patterns):
+    """Expand directories and glob patterns into a sorted list of project directories"""
+    projects = []
+    for pattern in patterns:
+        matches = glob.glob(pattern) if glob.has_magic(pattern) else [pattern]
+        projects += [m for m in sorted(matches) if os.path.isdir(m)]
+    # drop duplicates but keep order
+    return list(dict.fromkeys(os.path.normpath(p) for p in projects))
+
+
+def batch_output_names(projects):
+    """
+    Unique output file names (without extension) of the batch projects: the
+    project path relative to the common parent of all projects, '/' replaced
+    by '_'. `clients/a/input` and `clients/b/input` become `a_input` and
+    `b_input`; names that still collide get a numeric suffix.
+    """
+    paths = [os.path.abspath(p) for p in projects]
+    parent = os.path.commonpath([os.path.dirname(p) for p in paths])
+    names = []
+    seen = set()
+    for path in paths:
+        base = os.path.relpath(path, parent).replace(os.sep, "_")
+        name, n = base, 1
+        while name in seen:
+            n += 1
+            name = f"{base}_{n}"
+        seen.add(name)
+        names.append(name)
+    return names
+
+
+def run_batch(patterns, output_dir, sub_pos, pbspeed, train, asr_workers=1, render_workers=2, trace_path=None,
+              transcribe_workers=TRANSCRIBE_WORKERS, backend=DEFAULT_BACKEND, **video_options):
+    """
+    Render many project directories concurrently, each to
+    `<output_dir>/<name>.mp4` (see `batch_output_names`).
+    Transcription and rendering run on separate process pools so the ASR of
+    one project overlaps with the encode of another. Per-job status is printed
+    as jobs move through the pools and a summary manifest is written to
+    `<output_dir>/batch_manifest.json`.
+    trace_path: write the stage spans of every job (one trace process per
+    worker) as Chrome-trace JSON to this path
+    """
+    projects = expand_projects(patterns)
+    if not projects:
+        raise ValueError(f"No project directories match {patterns}")
+    # every ASR process keeps its own chunk pool, share the model replicas between them
+    chunk_workers = max(1, transcribe_workers // max(1, asr_workers))
+    if chunk_workers != transcribe_workers:
+        print(f"{asr_workers} transcription processes: {chunk_workers} chunk worker(s) each")
+    transcribe_workers = chunk_workers
+    os.makedirs(output_dir, exist_ok=True)
+
+    jobs = {}
+    for project, name in zip(projects, batch_output_names(projects)):
+        jobs[project] = {
+            'input': project,
+            'output': os.path.join(output_dir, name + ".mp4"),
+            'status': 'queued',
+            'error': None,
+            'audio_seconds': None,
+            'render_seconds': None,
+        }
+
+    def report(job, status, error=None):
+        job['status'] = status
+        job['error'] = error
+        done = sum(1 for j in jobs.values() if j['status'] in ('done', 'failed'))
+        print(f"[batch {done}/{len(jobs)}] {job['input']}: {status}" + (f" ({error})" if error else ""))
+
+    trace_events = []
+    batch_start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=asr_workers) as asr_pool, \
+            ProcessPoolExecutor(max_workers=render_workers) as render_pool:
+        asr_futures = {}
+        for project, job in jobs.items():
+            asr_futures[asr_pool.submit(_timed, prepare_job, project, train, transcribe_workers, backend)] = job
+            report(job, 'transcribing')
+
+        render_futures = {}
+        for future in as_completed(asr_futures):
+            job = asr_futures[future]
+            try:
+                prepared, job['audio_seconds'], events = future.result()
+            except Exception as e:
+                report(job, 'failed', repr(e))
+                continue
+            trace_events += events
+            render_futures[render_pool.submit(_timed, render_job, prepared, job['output'], sub_pos, pbspeed, **video_options)] = job
+            report(job, 'rendering')
+
+        for future in as_completed(render_futures):
+            job = render_futures[future]
+            try:
+                _, job['render_seconds'], events = future.result()
+            except Exception as e:
+                report(job, 'failed', repr(e))
+                continue
+            trace_events += events
+            report(job, 'done')
+
+    manifest = {
+        'wall_seconds': time.perf_counter() - batch_start,
+        'succeeded': sum(1 for j in jobs.values() if j['status'] == 'done'),
+        'failed': sum(1 for j in jobs.values() if j['status'] == 'failed'),
+        'jobs': list(jobs.values()),
+    }
+    manifest_path = os.path.join(output_dir, "batch_manifest.json")
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"batch finished: {manifest['succeeded']} done, {manifest['failed']} failed, manifest at {manifest_path}")
+    if trace_path:
+        TRACER.write_chrome_trace(trace_path, trace_events)
+        print(TRACER.summary(trace_events))
+    return manifest
+
 
 def main():
     parser = argparse.ArgumentParser(description='Create Social Media Shorts')
@@ -14,41 +223,72 @@ def main():
     parser.add_argument('--sub_pos', type=str, default="center", help='Subtitle vertical position percentage(0-100  -->  top-bottom)')
     parser.add_argument('--pbspeed', type=float, default=1.0, help='Playback speed factor')
     parser.add_argument('--train', type=int, default=0, help='For the audio training')
+    parser.add_argument('--batch', type=str, nargs='+', default=None, help='Project directories or glob patterns to render in batch mode')
+    parser.add_argument('--output_dir', type=str, default='outputs', help='Batch mode: directory for the rendered videos and manifest')
+    parser.add_argument('--asr_workers', type=int, default=1, help='Batch mode: number of transcription processes')
+    parser.add_argument('--render_workers', type=int, default=2, help='Batch mode: number of rendering processes')
+    parser.add_argument('--backend', type=str, default=DEFAULT_BACKEND, choices=sorted(TRANSCRIPTION_BACKENDS), help='Word timing backend: whisper (ASR), forced (alignment of the script) or stub (offline testing)')
+    parser.add_argument('--transcribe_workers', type=int, default=TRANSCRIBE_WORKERS, help='Processes transcribing the silence-split chunks of long voiceovers')
+    parser.add_argument('--fps', type=int, default=None, help='Output frame rate (default 24)')
+    parser.add_argument('--crf', type=int, default=None, help='x264 constant rate factor, lower is better quality (default 23)')
+    parser.add_argument('--preset', type=str, default=None, help='x264 preset, e.g. ultrafast, fast, slow (default fast)')
+    parser.add_argument('--tune', type=str, default=None, help='x264 tune, e.g. stillimage')
+    parser.add_argument('--threads', type=int, default=None, help='Encoder threads (default 4)')
+    parser.add_argument('--gop', type=int, default=None, help='Keyframe interval in frames')
+    parser.add_argument('--pix_fmt', type=str, default=None, help='Output pixel format (default yuv420p)')
+    parser.add_argument('--resolution', type=str, default=None, help='Output size WIDTHxHEIGHT (positive, even), e.g. 1080x1920 (default: size of the first image)')
+    parser.add_argument('--fit', type=str, default="crop", choices=["crop", "letterbox", "stretch"], help='How images are fitted to the output size')
+    parser.add_argument('--segment_workers', type=int, default=1, help='Render the segments between image changes in this many processes')
+    parser.add_argument('--incremental', action='store_true', help='Reuse rendered segments that did not change since the last run')
+    parser.add_argument('--preview', action='store_true', help='Fast draft render: reduced size and fps, ultrafast encoding, scaled subtitles')
+    parser.add_argument('--time_range', type=str, default=None, help='Only render START-END (seconds of the output video)')
+    parser.add_argument('--segment', type=int, default=None, help='Only render the segment of this image (0-based)')
+    parser.add_argument('--subtitle_renderer', type=str, default="overlay", choices=SUBTITLE_RENDERERS, help='overlay: numpy compositing, ass: write <output>.ass and burn it in with libass')
+    parser.add_argument('--renditions', type=str, nargs='+', default=None, help='Extra outputs from the same render, WIDTHxHEIGHT[:option=value,...], e.g. 720x1280:crf=26 540x960:bitrate=1M')
+    parser.add_argument('--duck', type=str, default=None, choices=["words", "rms"], help='Lower the background music while the voice speaks, driven by the word timestamps or the voiceover level')
+    parser.add_argument('--duck_db', type=float, default=None, help='Ducking depth in dB (default 12)')
+    parser.add_argument('--duck_attack', type=float, default=None, help='Seconds to reach full ducking (default 0.08)')
+    parser.add_argument('--duck_release', type=float, default=None, help='Seconds to recover after speech (default 0.4)')
+    parser.add_argument('--scratch_in_ram', action='store_true', help='Keep intermediate files of the render in /dev/shm')
+    parser.add_argument('--trace', type=str, default=None, help='Write per-stage timings as Chrome-trace/Perfetto JSON to this path')
     
     print("looking into arguments")
     args = parser.parse_args()
     print("arguments are: ", args)
 
-    status = validate_inputs(args.input)
-    
-    if status is None:
-        raise ValueError("Invalid input files")
-    else:
-        imgs_dir, foreaudio_dir, backauido_dir, script_dir = status
+    video_options = {
+        'encoder': encoder_profile(fps=args.fps, crf=args.crf, preset=args.preset, tune=args.tune,
+                                   threads=args.threads, gop=args.gop, pix_fmt=args.pix_fmt),
+        'resolution': parse_resolution(args.resolution),
+        'fit': args.fit,
+        'segment_workers': args.segment_workers,
+        'incremental': args.incremental,
+        'preview': args.preview,
+        'time_range': parse_time_range(args.time_range),
+        'segment': args.segment,
+        'scratch_in_ram': args.scratch_in_ram,
+        'subtitle_renderer': args.subtitle_renderer,
+        'renditions': [parse_rendition(value) for value in args.renditions or []],
+        'ducking': ducking_profile(source=args.duck, depth_db=args.duck_db, attack=args.duck_attack,
+                                   release=args.duck_release) if args.duck else None,
+    }
 
-    audio_duration = check_audio_duration(foreaudio_dir)
-    if audio_duration > 40:
-        print("Warning: Audio exceeds 40 seconds - platform limits may apply")
-    
-    # Count number of images in directory
-    num_images = len([f for f in os.listdir(imgs_dir) if f.endswith(('.png', '.jpg', '.jpeg'))])
-    
-    # Count number of lines in script
-    with open(script_dir, 'r') as f:
-        num_lines = sum(1 for line in f if line.strip())
-        
-    if num_images < num_lines:
-        raise ValueError(f"Not enough images ({num_images}) for script lines ({num_lines}). Each line needs a corresponding image.")
-    elif num_images > num_lines:
-        raise ValueError(f"Warning: More images ({num_images}) than script lines ({num_lines}). Extra images will be ignored.")
+    if args.batch:
+        run_batch(args.batch, args.output_dir, args.sub_pos, args.pbspeed, args.train,
+                  asr_workers=args.asr_workers, render_workers=args.render_workers,
+                  trace_path=args.trace, transcribe_workers=args.transcribe_workers,
+                  backend=args.backend, **video_options)
+        return
 
-    processed_audio = process_audio(foreaudio_dir, script_dir, args.train, backauido_dir)
-    process_video(imgs_dir, script_dir, processed_audio,
-                 args.output, args.sub_pos,args.pbspeed, background_volume=0.3)
+    try:
+        prepared = prepare_job(args.input, args.train, args.transcribe_workers, args.backend)
+        render_job(prepared, args.output, args.sub_pos, args.pbspeed, **video_options)
+    finally:
+        # also for failed or interrupted renders, the trace shows how far they got
+        if args.trace:
+            TRACER.write_chrome_trace(args.trace)
+            print(TRACER.summary())
 
 
 if __name__ == "__main__":
     main()
-
-
-
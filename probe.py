@@ -0,0 +1,99 @@
+#############################
+# probe.py
+#############################
+# One pass over a project directory: file lists, content hashes, image sizes
+# (header reads) and audio durations / sample rates (WAV header or ffprobe).
+# The resulting manifest is cached by the files' sizes and mtimes and handed
+# to every later stage, so no stage lists, hashes or opens an input again
+# just to learn something the probe already knows.
+#
+#   python probe.py ./input/project --output manifest.json
+#
+import argparse
+import json
+import os
+
+from cache import CACHE_ROOT, DiskCache, file_digest, make_key
+from image_cache import image_size
+from utils import audio_info, list_images, validate_inputs
+
+MANIFEST_VERSION = 2
+PROBE_CACHE = DiskCache(os.path.join(CACHE_ROOT, "probe"), max_bytes=64 * 1024 * 1024)
+
+
+def _stat_signature(paths):
+    signature = []
+    for path in paths:
+        st = os.stat(path)
+        signature.append([path, st.st_size, st.st_mtime_ns])
+    return signature
+
+
+def _file_entry(path):
+    return {'path': path, 'bytes': os.path.getsize(path), 'sha256': file_digest(path)}
+
+
+def probe_project(input_dir, use_cache=True):
+    """
+    Manifest of a project in the `validate_inputs` layout:
+      images: [{path, bytes, sha256, size: [w, h]}] in `list_images` order
+      script: {path, bytes, sha256, lines: non-empty lines}
+      voiceover / background: {path, bytes, sha256, duration, sample_rate, channels}
+    (background is None when the project has none). Paths are absolute, the
+    cached manifest is shared by every working directory.
+    Raises ValueError when the layout is invalid.
+    """
+    status = validate_inputs(input_dir)
+    if status is None:
+        raise ValueError("Invalid input files")
+    input_dir = os.path.abspath(input_dir)
+    image_dir, voice_path, background_path, script_path = (os.path.abspath(path) if path else path
+                                                           for path in status)
+    images = [os.path.abspath(path) for path in list_images(image_dir)]
+
+    files = images + [script_path, voice_path] + ([background_path] if background_path else [])
+    key = make_key("probe", MANIFEST_VERSION, input_dir, _stat_signature(files))
+    if use_cache:
+        manifest = PROBE_CACHE.get(key)
+        if manifest is not None:
+            return manifest
+
+    with open(script_path, "r", encoding="utf-8") as f:
+        lines = [line.strip() for line in f if line.strip()]
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'input_dir': input_dir,
+        'image_dir': image_dir,
+        'images': [dict(_file_entry(path), size=list(image_size(path))) for path in images],
+        'script': dict(_file_entry(script_path), lines=lines),
+        'voiceover': dict(_file_entry(voice_path), **audio_info(voice_path)),
+        'background': dict(_file_entry(background_path), **audio_info(background_path)) if background_path else None,
+    }
+    PROBE_CACHE.put(key, manifest)
+    return manifest
+
+
+def write_manifest(manifest, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(manifest, f, indent=2)
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Probe a project directory and print its manifest')
+    parser.add_argument('input', type=str, help='Project directory')
+    parser.add_argument('--output', type=str, default=None, help='Write the manifest as JSON to this path')
+    parser.add_argument('--no_cache', action='store_true', help='Probe again even if the files did not change')
+    args = parser.parse_args()
+
+    manifest = probe_project(args.input, use_cache=not args.no_cache)
+    if args.output:
+        print("manifest written to", write_manifest(manifest, args.output))
+    else:
+        print(json.dumps(manifest, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#############################
+# segment_render.py
+#############################
+# Segmented rendering: the frame grid is cut at the image (sentence) boundaries,
+# every segment is encoded to its own file, optionally by a pool of processes,
+# with the same encoder profile, and the files are joined with ffmpeg's concat
+# demuxer without re-encoding. The mixed audio is muxed once during the join.
+# Encoded segments are kept in a render cache keyed by everything that affects
+# their pixels, so a re-run only encodes the segments that changed.
+import math
+import os
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+from cache import CACHE_ROOT, DiskCache, make_key
+from encoder import encode_frames
+
+SEGMENT_CACHE = DiskCache(os.path.join(CACHE_ROOT, "segments"),
+                          max_bytes=2 * 1024 * 1024 * 1024, suffix=".mp4")
+
+# per-process renderer built once by the pool initializer
+_WORKER = {}
+
+
+def first_frame_at(t, fps, playback_speed=1.0):
+    """Index of the first frame whose timeline time (i / fps * speed) is >= t"""
+    k = max(0, math.ceil(t * fps / playback_speed))
+    # guard against float rounding in either direction
+    while k > 0 and (k - 1) / fps * playback_speed >= t:
+        k -= 1
+    while k / fps * playback_speed < t:
+        k += 1
+    return k
+
+
+def segment_frame_ranges(boundaries, n_frames, fps, playback_speed=1.0):
+    """
+    Split the frames [0, n_frames) at every boundary time (timeline seconds).
+    Returns a list of (first, last) frame index pairs, last excluded.
+    """
+    cuts = {0, n_frames}
+    for boundary in boundaries:
+        k = first_frame_at(boundary, fps, playback_speed)
+        if 0 < k < n_frames:
+            cuts.add(k)
+    cuts = sorted(cuts)
+    return list(zip(cuts[:-1], cuts[1:]))
+
+
+def segment_key(first, last, image_digest, overlay_digest, size, fps, playback_speed, profile, fit):
+    """Render cache key of the frames [first, last) of a timeline"""
+    return make_key("segment", first, last, image_digest, overlay_digest, list(size),
+                    fps, playback_speed, profile, fit)
+
+
+def _init_worker(build, build_args):
+    # `build` returns (renderer, ...) like video_processor.build_renderer
+    _WORKER['renderer'] = build(*build_args)[0]
+
+
+def _encode_range(renderer, first, last, size, fps, playback_speed, output_path, profile):
+    frames = (renderer.get_frame(i / fps * playback_speed) for i in range(first, last))
+    return encode_frames(frames, size, output_path, profile)
+
+
+def _render_segment(first, last, size, fps, playback_speed, output_path, profile):
+    return _encode_range(_WORKER['renderer'], first, last, size, fps, playback_speed, output_path, profile)
+
+
+def render_segments(build, build_args, jobs, size, fps, playback_speed, profile, workers, renderer=None,
+                    progress=None):
+    """
+    Encode every (first, last, output_path) job to its own video-only file.
+    With `workers` > 1 the jobs run on a process pool whose workers each call
+    `build(*build_args)` once to get their renderer; otherwise they are encoded
+    here with `renderer`. Returns the per-job encode stats in job order.
+    progress: called with the frame count of every finished job
+    """
+    if not jobs:
+        return []
+    if workers <= 1 and renderer is not None:
+        stats = []
+        for first, last, path in jobs:
+            stats.append(_encode_range(renderer, first, last, size, fps, playback_speed, path, profile))
+            if progress:
+                progress(stats[-1]['frames'])
+        return stats
+
+    with ProcessPoolExecutor(max_workers=max(1, min(workers, len(jobs))),
+                             initializer=_init_worker, initargs=(build, build_args)) as pool:
+        futures = [
+            pool.submit(_render_segment, first, last, size, fps, playback_speed, path, profile)
+            for first, last, path in jobs
+        ]
+        if progress:
+            def report(future):
+                if future.exception() is None:
+                    progress(future.result()['frames'])
+
+            for future in futures:
+                future.add_done_callback(report)
+        return [future.result() for future in futures]
+
+
+def concat_segments(paths, output_path, profile, audio_path=None, list_path=None):
+    """
+    Join segment files with the concat demuxer (stream copy) and mux
+    `audio_path` encoded with the profile's audio codec.
+    list_path: where to write the demuxer's file list, next to the output by default
+    """
+    list_path = list_path or f"{output_path}.segments.txt"
+    with open(list_path, "w") as f:
+        for path in paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0", "-i", list_path]
+    if audio_path is not None:
+        cmd += ["-i", audio_path, "-map", "0:v", "-map", "1:a", "-c:a", profile['audio_codec']]
+    cmd += ["-c:v", "copy", output_path]
+    try:
+        subprocess.run(cmd, check=True)
+    finally:
+        os.remove(list_path)
+    return output_path
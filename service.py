@@ -0,0 +1,414 @@
+#############################
+# service.py
+#############################
+# Long-running local render service. Projects (directories in the
+# `validate_inputs` layout) are submitted over HTTP, queued and rendered by a
+# fixed number of job threads in this process, so the transcription model,
+# font metrics, glyph atlases and sprite caches stay warm between jobs.
+#
+#   python service.py --max_jobs 2 --backend stub
+#   curl -X POST localhost:8765/jobs -H 'Content-Type: application/json' -d '{"input": "./input/project", "sub_pos": 60}'
+#   curl localhost:8765/jobs/<id>
+#
+import argparse
+import json
+import os
+import queue
+import threading
+import time
+import traceback
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from audio_processor import (DEFAULT_BACKEND, TRANSCRIBE_WORKERS, TRANSCRIPTION_BACKENDS,
+                             load_whisper_model)
+from audio_mix import ducking_profile
+from encoder import encoder_profile, parse_rendition
+from image_cache import FIT_POLICIES
+from main import parse_resolution, parse_time_range, prepare_job, render_job
+from tracing import TRACER
+from video_processor import SUBTITLE_RENDERERS
+
+DEFAULT_SERVICE_ADDRESS = ("127.0.0.1", 8765)
+
+def _choice(choices):
+    def parse(value):
+        if value not in choices:
+            raise ValueError(f"expected one of {choices}")
+        return value
+    return parse
+
+
+def _flag(value):
+    # bool("false") is True, so only JSON booleans are accepted
+    if not isinstance(value, bool):
+        raise ValueError("expected true or false")
+    return value
+
+
+def _renditions(values):
+    # a bare string would be iterated character by character
+    if not isinstance(values, list):
+        raise ValueError('expected a list such as ["720x1280", "480x854:crf=28"]')
+    return [parse_rendition(value) for value in values]
+
+
+def _ducking(value):
+    return ducking_profile(**value) if isinstance(value, dict) else ducking_profile(source=value)
+
+
+# encoder_profile arguments a job may set, with their parsers
+ENCODER_OPTIONS = {
+    'fps': int,
+    'crf': int,
+    'bitrate': str,
+    'preset': str,
+    'tune': str,
+    'threads': int,
+    'gop': int,
+    'pix_fmt': str,
+}
+# process_video arguments a job may set, with their parsers
+VIDEO_OPTIONS = {
+    'resolution': parse_resolution,
+    'fit': _choice(FIT_POLICIES),
+    'segment_workers': int,
+    'incremental': _flag,
+    'preview': _flag,
+    'time_range': parse_time_range,
+    'segment': int,
+    'scratch_in_ram': _flag,
+    'subtitle_renderer': _choice(SUBTITLE_RENDERERS),
+    'renditions': _renditions,
+    'ducking': _ducking,
+}
+
+
+def _parse_options(request, parsers):
+    """Parse the options of `request` named in `parsers`, naming the option on failure"""
+    options = {}
+    for name, parse in parsers.items():
+        if request.get(name) is None:
+            continue
+        try:
+            options[name] = parse(request[name])
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"Invalid {name} {request[name]!r}: {e}")
+    return options
+
+def service_address():
+    """Service address from SHORTGEN_SERVICE_ADDRESS ("host:port") or the default"""
+    value = os.environ.get("SHORTGEN_SERVICE_ADDRESS")
+    if not value:
+        return DEFAULT_SERVICE_ADDRESS
+    host, port = value.rsplit(":", 1)
+    return (host, int(port))
+
+
+def parse_job_request(request, default_backend=DEFAULT_BACKEND):
+    """
+    Validate a submitted job and split it into render arguments.
+    `request` keys: input (required), output, sub_pos, pbspeed, train, backend,
+    the encoder settings of ENCODER_OPTIONS and the video options of VIDEO_OPTIONS.
+    Raises ValueError for unknown keys or bad values.
+    """
+    try:
+        return _parse_job_request(request, default_backend)
+    except (TypeError, AttributeError) as e:
+        # values of the wrong JSON type, e.g. {"sub_pos": null} or {"resolution": 1080}
+        raise ValueError(f"Invalid job options: {e}")
+
+
+def _parse_job_request(request, default_backend):
+    known = {'input', 'output', 'sub_pos', 'pbspeed', 'train', 'backend', *ENCODER_OPTIONS, *VIDEO_OPTIONS}
+    unknown = sorted(set(request) - known)
+    if unknown:
+        raise ValueError(f"Unknown job options: {', '.join(unknown)}")
+    if not request.get('input') or not os.path.isdir(request['input']):
+        raise ValueError(f"Input directory not found: {request.get('input')}")
+    backend = request.get('backend', default_backend)
+    if backend not in TRANSCRIPTION_BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {sorted(TRANSCRIPTION_BACKENDS)}")
+
+    video_options = _parse_options(request, VIDEO_OPTIONS)
+    video_options['encoder'] = encoder_profile(**_parse_options(request, ENCODER_OPTIONS))
+    parsed = {
+        'input': request['input'],
+        'output': request.get('output'),
+        'sub_pos': float(request.get('sub_pos', 60)),
+        'pbspeed': float(request.get('pbspeed', 1.0)),
+        'train': int(request.get('train', 0)),
+        'backend': backend,
+        'video_options': video_options,
+    }
+    if not parsed['pbspeed'] > 0:
+        raise ValueError(f"Invalid pbspeed {parsed['pbspeed']}, expected a positive number")
+    return parsed
+
+
+class RenderService:
+    """
+    Job queue with bounded concurrency. `max_jobs` threads take jobs in
+    submission order; transcription is serialized (one model, one decode at a
+    time) while the other jobs keep rendering.
+    Job states: queued -> transcribing -> rendering -> done | failed.
+    """
+
+    def __init__(self, output_dir="outputs", max_jobs=2, backend=DEFAULT_BACKEND,
+                 transcribe_workers=TRANSCRIBE_WORKERS):
+        self.output_dir = output_dir
+        self.max_jobs = max_jobs
+        self.backend = backend
+        self.transcribe_workers = transcribe_workers
+        self._jobs = {}
+        self._requests = {}
+        self._threads_jobs = {}
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._asr_lock = threading.Lock()
+        self._threads = []
+
+    def start(self):
+        for _ in range(self.max_jobs):
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        """Let the running jobs finish and stop the job threads"""
+        for _ in self._threads:
+            self._queue.put(None)
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def warm_up(self):
+        """Load the Whisper model up front so the first job does not pay for it"""
+        if self.backend == "whisper":
+            load_whisper_model()
+
+    def output_path(self, output):
+        """
+        Absolute path of a job's `output`, relative to the output directory.
+        Raises ValueError for paths that resolve outside of it, so a request
+        cannot overwrite arbitrary files.
+        """
+        root = os.path.realpath(self.output_dir)
+        path = os.path.realpath(os.path.join(root, output))
+        if os.path.commonpath([root, path]) != root or path == root:
+            raise ValueError(f"Output must be a file inside the output directory {self.output_dir}")
+        return path
+
+    def submit(self, request):
+        """Queue a job request (see `parse_job_request`), returns the job status"""
+        parsed = parse_job_request(request, self.backend)
+        job_id = uuid.uuid4().hex[:12]
+        output = self.output_path(parsed['output'] or
+                                  f"{os.path.basename(os.path.normpath(parsed['input']))}_{job_id}.mp4")
+        job = {
+            'id': job_id,
+            'input': parsed['input'],
+            'output': output,
+            'backend': parsed['backend'],
+            'status': 'queued',
+            'progress': 0.0,
+            'frames': None,
+            'error': None,
+            'submitted': time.time(),
+            'started': None,
+            'finished': None,
+            'stages': {},
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._requests[job_id] = parsed
+        self._queue.put(job_id)
+        print(f"[service] job {job_id} queued: {parsed['input']} -> {output}")
+        return self.status(job_id)
+
+    def status(self, job_id):
+        """Copy of the job status, None for an unknown id"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return json.loads(json.dumps(job)) if job else None
+
+    def jobs(self):
+        with self._lock:
+            return json.loads(json.dumps(list(self._jobs.values())))
+
+    def counts(self):
+        with self._lock:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job['status']] = counts.get(job['status'], 0) + 1
+            return counts
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            self._jobs[job_id].update(fields)
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            if job_id is None:
+                return
+            self._run(job_id)
+
+    def _run(self, job_id):
+        request = self._requests[job_id]
+        job = self._jobs[job_id]
+        with self._lock:
+            self._threads_jobs[threading.get_ident()] = job_id
+
+        def progress(done, total):
+            self._update(job_id, frames=[done, total], progress=round(done / total, 4) if total else 1.0)
+
+        self._update(job_id, status='transcribing', started=time.time())
+        try:
+            with self._asr_lock:
+                prepared = prepare_job(request['input'], request['train'],
+                                       self.transcribe_workers, request['backend'])
+            self._update(job_id, status='rendering')
+            render_job(prepared, job['output'], request['sub_pos'], request['pbspeed'],
+                       progress=progress, **request['video_options'])
+            self._update(job_id, status='done', progress=1.0)
+        except Exception as e:
+            traceback.print_exc()
+            self._update(job_id, status='failed', error=repr(e))
+        finally:
+            self._update(job_id, finished=time.time())
+            self._collect_spans()
+            with self._lock:
+                del self._threads_jobs[threading.get_ident()]
+                del self._requests[job_id]
+            print(f"[service] job {job_id} {job['status']}" + (f" ({job['error']})" if job['error'] else ""))
+
+    def _collect_spans(self):
+        # Stage timings of every job from the shared tracer, by job thread
+        events = TRACER.drain()
+        with self._lock:
+            for event in events:
+                job_id = self._threads_jobs.get(event['tid'])
+                if job_id is not None:
+                    self._jobs[job_id]['stages'][event['name']] = event['args']['wall_s']
+
+
+class _Handler(BaseHTTPRequestHandler):
+    service = None
+
+    def _reply(self, code, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        path = self.path.rstrip("/")
+        if path == "/health":
+            self._reply(200, {'status': 'ok', 'max_jobs': self.service.max_jobs, 'jobs': self.service.counts()})
+        elif path == "/jobs":
+            self._reply(200, self.service.jobs())
+        elif path.startswith("/jobs/"):
+            job = self.service.status(path[len("/jobs/"):])
+            if job is None:
+                self._reply(404, {'error': 'unknown job'})
+            else:
+                self._reply(200, job)
+        else:
+            self._reply(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/jobs":
+            self._reply(404, {'error': 'not found'})
+            return
+        # browsers send cross-origin text/plain or form posts without a preflight, never JSON
+        content_type = self.headers.get("Content-Type", "").split(";")[0].strip().lower()
+        if content_type != "application/json":
+            self._reply(415, {'error': 'Content-Type must be application/json'})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length) or b"{}")
+            if not isinstance(request, dict):
+                raise ValueError("Job request must be a JSON object")
+            self._reply(202, self.service.submit(request))
+        except ValueError as e:
+            self._reply(400, {'error': str(e)})
+        except Exception as e:
+            traceback.print_exc()
+            self._reply(500, {'error': repr(e)})
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(service, address=None):
+    """Serve `service` over HTTP until interrupted"""
+    address = address or service_address()
+    handler = type("Handler", (_Handler,), {'service': service})
+    with ThreadingHTTPServer(address, handler) as server:
+        print(f"render service: {service.max_jobs} job(s) at a time, backend '{service.backend}', "
+              f"listening on http://{address[0]}:{address[1]}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            service.stop()
+
+
+def _call(method, path, body=None, address=None):
+    host, port = address or service_address()
+    data = None if body is None else json.dumps(body).encode("utf-8")
+    request = Request(f"http://{host}:{port}{path}", data=data, method=method,
+                      headers={"Content-Type": "application/json"})
+    try:
+        with urlopen(request) as response:
+            return json.loads(response.read())
+    except HTTPError as e:
+        raise RuntimeError(f"render service: {json.loads(e.read()).get('error')}")
+
+
+def submit_job(input_dir, address=None, **options):
+    """Submit a project to a running service, returns the job status"""
+    return _call("POST", "/jobs", dict(options, input=input_dir), address)
+
+
+def job_status(job_id, address=None):
+    return _call("GET", f"/jobs/{job_id}", address=address)
+
+
+def wait_for_job(job_id, address=None, poll_seconds=1.0):
+    """Poll until the job is done or failed, returns its final status"""
+    while True:
+        job = job_status(job_id, address)
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(poll_seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Local render service with a job queue')
+    parser.add_argument('--host', type=str, default=None, help='Listen address (default from SHORTGEN_SERVICE_ADDRESS)')
+    parser.add_argument('--port', type=int, default=None, help='Listen port')
+    parser.add_argument('--max_jobs', type=int, default=2, help='Jobs rendered at the same time')
+    parser.add_argument('--output_dir', type=str, default='outputs', help='Directory of the rendered videos, job output paths are relative to it')
+    parser.add_argument('--backend', type=str, default=DEFAULT_BACKEND, choices=sorted(TRANSCRIPTION_BACKENDS), help='Default word timing backend')
+    parser.add_argument('--transcribe_workers', type=int, default=TRANSCRIBE_WORKERS, help='Processes transcribing the silence-split chunks of long voiceovers')
+    parser.add_argument('--preload', action='store_true', help='Load the Whisper model before accepting jobs')
+    args = parser.parse_args()
+
+    host, port = service_address()
+    service = RenderService(args.output_dir, args.max_jobs, args.backend, args.transcribe_workers)
+    if args.preload:
+        service.warm_up()
+    serve(service.start(), (args.host or host, args.port or port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+#############################
+# span_renderer.py
+#############################
+# A short is a handful of still images with word highlights switching a few
+# times per second, so most consecutive frames are identical. The renderer
+# below composes one frame per static span and hands the same buffer back for
+# every frame until the next visual change point.
+from bisect import bisect_right
+
+
+def change_points(video_clip, overlay):
+    """
+    Sorted times at which the picture can change: image switches and the end
+    of the image track, page switches, and highlight starts/ends.
+    """
+    points = {0.0}
+    points.update(getattr(video_clip, 'timings', [video_clip.start, video_clip.end]))
+    if video_clip.end is not None:
+        points.add(video_clip.end)
+    points.update(overlay.change_points())
+    return sorted(points)
+
+
+class StaticSpanRenderer:
+    """
+    Wraps a `frame_function(t)` and only calls it once per span between two
+    change points; frames requested inside the same span reuse the cached buffer.
+    """
+
+    def __init__(self, frame_function, points):
+        self.frame_function = frame_function
+        self.points = points
+        self.rendered = 0
+        self.reused = 0
+        self._span = None
+        self._frame = None
+
+    def get_frame(self, t):
+        span = bisect_right(self.points, t) - 1
+        if span == self._span:
+            self.reused += 1
+            return self._frame
+        self._frame = self.frame_function(t)
+        self._span = span
+        self.rendered += 1
+        return self._frame
+
+    def stats(self):
+        total = self.rendered + self.reused
+        return {
+            "frames": total,
+            "composed": self.rendered,
+            "reused": self.reused,
+            "spans": len(self.points),
+        }
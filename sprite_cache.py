@@ -0,0 +1,69 @@
+#############################
+# sprite_cache.py
+#############################
+import threading
+from collections import OrderedDict
+
+
+class SpriteCache:
+    """
+    In-memory LRU cache of rendered RGBA sprites (numpy uint8 arrays).
+    Keys are tuples describing everything that affects the pixels (text, font,
+    size, colors, stroke, padding, radius). The total size of the stored arrays
+    is kept under `max_bytes`, least recently used sprites are dropped first.
+    Safe to share between threads; sprites are rendered outside the lock.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_or_render(self, key, render):
+        """Return the sprite for `key`, calling `render()` to build it on a miss"""
+        with self._lock:
+            sprite = self._entries.get(key)
+            if sprite is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return sprite
+            self.misses += 1
+
+        sprite = render()
+        # Shared between clips and jobs, nobody may draw into it
+        sprite.flags.writeable = False
+        with self._lock:
+            if key in self._entries:
+                # rendered concurrently by another thread, keep the stored one
+                return self._entries[key]
+            self._entries[key] = sprite
+            self.bytes += sprite.nbytes
+            while self.bytes > self.max_bytes and len(self._entries) > 1:
+                _, old = self._entries.popitem(last=False)
+                self.bytes -= old.nbytes
+        return sprite
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "sprites": len(self._entries),
+            "bytes": self.bytes,
+        }
+
+
+# One cache per process: shared by every segment and every job the process renders
+SPRITE_CACHE = SpriteCache()
@@ -0,0 +1,245 @@
+#############################
+# subtitle_overlay.py
+#############################
+# Numpy subtitle compositor. Produces the same pixels as stacking the
+# `create_subtitles` CompositeVideoClips over the video, but every page is
+# flattened once up front and each frame only blits the active page and the
+# active word highlight.
+import hashlib
+from bisect import bisect_right
+
+import numpy as np
+
+from subtitles import layout_subtitles, rounded_rect_sprite
+
+
+def _blend(dst, src, alpha):
+    """
+    Integer alpha blend with the exact rounding of PIL's `Image.paste(img, box, mask)`.
+    dst, src: uint8 (h, w, c) arrays, alpha: uint8 (h, w) array
+    """
+    a = alpha.astype(np.int32)[..., None]
+    tmp = dst.astype(np.int32) * (255 - a) + src.astype(np.int32) * a + 128
+    return ((tmp + (tmp >> 8)) >> 8).astype(np.uint8)
+
+
+def _paste(canvas_rgb, canvas_mask, rgba, pos, region=(0, 0)):
+    """
+    Paste an RGBA sprite the way moviepy composites a clip inside a page:
+    the colors are blended through the sprite alpha, and the page mask is
+    overwritten by the fully opaque pixels of the sprite.
+    `region` is the page coordinate of canvas pixel (0, 0).
+    """
+    x = int(pos[0]) - region[0]
+    y = int(pos[1]) - region[1]
+    h, w = canvas_mask.shape
+    sh, sw = rgba.shape[:2]
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + sw, w), min(y + sh, h)
+    if x1 <= x0 or y1 <= y0:
+        return
+    src = rgba[y0 - y:y1 - y, x0 - x:x1 - x]
+    alpha = src[..., 3]
+    canvas_rgb[y0:y1, x0:x1] = _blend(canvas_rgb[y0:y1, x0:x1], src[..., :3], alpha)
+    canvas_mask[y0:y1, x0:x1] = alpha == 255
+
+
+def _flatten(sprites, size, region=(0, 0)):
+    """Composite (rgba, pos) sprites over black, returns (rgb, opaque mask)"""
+    w, h = size
+    rgb = np.zeros((h, w, 3), dtype=np.uint8)
+    mask = np.zeros((h, w), dtype=bool)
+    for rgba, pos in sprites:
+        _paste(rgb, mask, rgba, pos, region)
+    return rgb, mask
+
+
+class SubtitleOverlay:
+    """
+    Timeline-indexed subtitle renderer.
+    At construction every page is flattened into an RGB image plus an opaque
+    mask, and every word highlight into a small patch covering its highlight
+    box. Pages and highlights are kept sorted by start time, so `render`
+    finds the active ones with a binary search and blits them with integer
+    alpha compositing.
+    """
+
+    def __init__(self, pages):
+        self.pages = []
+        for page in pages:
+            self.pages.append(self._prepare_page(page))
+        self.pages.sort(key=lambda p: p['start'])
+        self._starts = [p['start'] for p in self.pages]
+        self._max_duration = max((p['duration'] for p in self.pages), default=0)
+        self.end = max((p['end'] for p in self.pages), default=0)
+
+    @staticmethod
+    def _prepare_page(page):
+        layout = page['layout']
+        size = (int(layout['width']), int(layout['height']))
+
+        # Same clip order as build_page_clip: page background, then for every
+        # word its normal text followed by its highlight background and text
+        base_sprites = []
+        if size[0] > 0 and size[1] > 0:
+            base_sprites.append((rounded_rect_sprite(size, page['bg_color'], page['bg_radius']), (0, 0)))
+        ordered = []
+        for placed in layout['words']:
+            w = placed['word']
+            normal = (w['normal_rgba'], placed['normal_pos'])
+            base_sprites.append(normal)
+            highlight = None
+            if placed['h_window'] is not None:
+                highlight = [(w['highlight_bg_rgba'], placed['highlight_bg_pos']),
+                             (w['highlight_rgba'], placed['highlight_txt_pos'])]
+            ordered.append((normal, highlight, placed['h_window']))
+
+        rgb, mask = _flatten(base_sprites, size)
+
+        highlights = []
+        for idx, (_, highlight, window) in enumerate(ordered):
+            if highlight is None:
+                continue
+            # Patch = the highlight box, re-composited with every clip that
+            # covers it in the original stacking order
+            x0 = max(0, min(int(pos[0]) for _, pos in highlight))
+            y0 = max(0, min(int(pos[1]) for _, pos in highlight))
+            x1 = min(size[0], max(int(pos[0]) + s.shape[1] for s, pos in highlight))
+            y1 = min(size[1], max(int(pos[1]) + s.shape[0] for s, pos in highlight))
+            if x1 <= x0 or y1 <= y0:
+                continue
+            sprites = base_sprites[:1]
+            for j, (normal, _, _) in enumerate(ordered):
+                sprites.append(normal)
+                if j == idx:
+                    sprites += highlight
+            patch_rgb, patch_mask = _flatten(sprites, (x1 - x0, y1 - y0), region=(x0, y0))
+            highlights.append({
+                'start': window[0],
+                'end': window[1],
+                'x': x0,
+                'y': y0,
+                'rgb': patch_rgb,
+                'mask': patch_mask,
+            })
+        highlights.sort(key=lambda hl: hl['start'])
+
+        duration = page['end'] - page['start']
+        return {
+            'start': page['start'],
+            'end': page['start'] + duration,
+            'duration': duration,
+            'y': int(page['sub_position']),
+            'width': size[0],
+            'rgb': rgb,
+            'mask': mask,
+            'highlights': highlights,
+            'highlight_starts': [hl['start'] for hl in highlights],
+            'max_highlight': max((hl['end'] - hl['start'] for hl in highlights), default=0),
+        }
+
+    def active_pages(self, t):
+        """Pages visible at time `t` in stacking order"""
+        idx = bisect_right(self._starts, t)
+        active = []
+        while idx > 0:
+            idx -= 1
+            page = self.pages[idx]
+            if page['start'] < t - self._max_duration:
+                break
+            if page['start'] <= t < page['end']:
+                active.append(page)
+        active.reverse()
+        return active
+
+    @staticmethod
+    def active_highlights(page, ct):
+        """Highlights of `page` visible at page-local time `ct`"""
+        idx = bisect_right(page['highlight_starts'], ct)
+        active = []
+        while idx > 0:
+            idx -= 1
+            hl = page['highlights'][idx]
+            if hl['start'] < ct - page['max_highlight']:
+                break
+            if hl['start'] <= ct < hl['end']:
+                active.append(hl)
+        active.reverse()
+        return active
+
+    def change_points(self):
+        """Absolute times at which the overlay picture changes"""
+        points = set()
+        for page in self.pages:
+            points.add(page['start'])
+            points.add(page['end'])
+            for hl in page['highlights']:
+                points.add(page['start'] + hl['start'])
+                points.add(page['start'] + hl['end'])
+        return sorted(points)
+
+    def fingerprint(self, t0, t1):
+        """
+        Digest of everything the overlay draws between `t0` and `t1`: timing,
+        position and pixels of every page (and its highlights) visible then.
+        Text, fonts, colors and sizes all end up in the pixels.
+        """
+        digest = hashlib.sha256()
+        for page in self.pages:
+            if page['start'] > t1 or page['end'] <= t0:
+                continue
+            digest.update(repr((page['start'], page['end'], page['y'], page['width'])).encode())
+            digest.update(page['rgb'].tobytes())
+            digest.update(page['mask'].tobytes())
+            for hl in page['highlights']:
+                digest.update(repr((hl['start'], hl['end'], hl['x'], hl['y'])).encode())
+                digest.update(hl['rgb'].tobytes())
+                digest.update(hl['mask'].tobytes())
+        return digest.hexdigest()
+
+    def render(self, frame, t):
+        """Return `frame` with the subtitles visible at time `t` drawn on top"""
+        pages = self.active_pages(t)
+        if not pages:
+            return frame
+
+        out = np.array(frame, dtype=np.uint8, copy=True)
+        for page in pages:
+            px = int((out.shape[1] - page['width']) / 2)
+            py = page['y']
+            highlights = []
+            for hl in self.active_highlights(page, t - page['start']):
+                box = self._clip_box(out, hl['mask'].shape, px + hl['x'], py + hl['y'])
+                if box is not None:
+                    # A highlight can make page pixels transparent again (its
+                    # rounded corners), so remember what was under the page
+                    highlights.append((hl, box, out[box[0]].copy()))
+
+            box = self._clip_box(out, page['mask'].shape, px, py)
+            if box is not None:
+                np.copyto(out[box[0]], page['rgb'][box[1]], where=page['mask'][box[1]][..., None])
+
+            for hl, box, under in highlights:
+                out[box[0]] = under
+                np.copyto(out[box[0]], hl['rgb'][box[1]], where=hl['mask'][box[1]][..., None])
+        return out
+
+    @staticmethod
+    def _clip_box(out, shape, x, y):
+        """(frame slices, sprite slices) of a sprite of `shape` at (x, y), None if off screen"""
+        fh, fw = out.shape[:2]
+        h, w = shape
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + w, fw), min(y + h, fh)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        return ((slice(y0, y1), slice(x0, x1)),
+                (slice(y0 - y, y1 - y), slice(x0 - x, x1 - x)))
+
+
+def create_subtitle_overlay(aligned_data, video_height, sub_position_percentage=0, **style):
+    """
+    Build a SubtitleOverlay for `aligned_data`.
+    `style` accepts the keyword arguments of `subtitles.layout_subtitles`.
+    """
+    return SubtitleOverlay(layout_subtitles(aligned_data, video_height, sub_position_percentage, **style))
@@ -1,7 +1,12 @@
+import inspect
+
 import numpy as np
 from PIL import Image, ImageDraw
-from moviepy.video.VideoClip import ImageClip, TextClip
+from moviepy.video.VideoClip import ImageClip
 from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip
+from font_metrics import font_metrics
+from glyph_atlas import word_rgba
+from sprite_cache import SPRITE_CACHE
 
 # --------------------------------------------------------------------
 # 1) Rounded Rectangle Helpers
@@ -27,27 +32,49 @@ def create_rounded_rect_image(size, rgba_color, radius):
     return Image.composite(solid, base, mask)
 
 
+def rounded_rect_sprite(size, rgba_color, radius):
+    """Cached RGBA array of `create_rounded_rect_image`"""
+    key = ("rounded_rect", tuple(size), rgba_color, radius)
+    return SPRITE_CACHE.get_or_render(
+        key, lambda: np.array(create_rounded_rect_image(size, rgba_color, radius))
+    )
+
+
+def sprite_clip(rgba):
+    """
+    ImageClip from an RGBA sprite: RGB frame plus the alpha channel as mask.
+    """
+    clip_rgb = ImageClip(rgba[..., :3])
+    mask_clip = ImageClip(rgba[..., 3] / 255.0, is_mask=True)
+    clip_rgb.mask = mask_clip
+    return clip_rgb
+
+
 def create_rounded_background(size, rgba_color, radius):
     """
     Returns an ImageClip shaped as a rounded rectangle with `rgba_color`.
     Preserves transparency and corner rounding via an alpha mask.
     """
-    pil_img = create_rounded_rect_image(size, rgba_color, radius)
-    arr = np.array(pil_img)  # shape: (H, W, 4)
-    rgb   = arr[..., :3]
-    alpha = arr[..., 3] / 255.0
+    return sprite_clip(rounded_rect_sprite(size, rgba_color, radius))
 
-    clip_rgb = ImageClip(rgb)
-    mask_clip = ImageClip(alpha, is_mask=True)
-    clip_rgb.mask = mask_clip
-    return clip_rgb
+
+def text_sprite(text, font, font_size, color, stroke_color, stroke_width, bg_color):
+    """
+    Cached RGBA array of a rendered word, pixel-identical to a TextClip.
+    Words are composed from the glyph atlas of their font, size and stroke;
+    common words are built once per process and reused across segments and jobs.
+    """
+    key = ("text", text, font, font_size, color, stroke_color, stroke_width, bg_color)
+    return SPRITE_CACHE.get_or_render(
+        key, lambda: word_rgba(text, font, font_size, color, stroke_color, stroke_width, bg_color)
+    )
 
 
 # --------------------------------------------------------------------
 # 2) Word Info (No Normal BG)
 # --------------------------------------------------------------------
 
-def prepare_word_info(
+def measure_word_info(
     text_str, w_start, w_end,
     normal_font, normal_font_size, normal_text_color, normal_stroke_color, normal_stroke_width, page_bg_color,
     highlight_font, highlight_font_size, highlight_text_color, highlight_stroke_color, highlight_stroke_width,
@@ -55,61 +82,65 @@ def prepare_word_info(
     padding
 ):
     """
-    Creates a 'word_info' dict for each word:
-      - Normal text (no normal background).
-      - Highlight background + highlight text.
+    Creates a 'word_info' dict with the word timing and the normal/highlight
+    box sizes taken from the font metrics. Nothing is rasterized; the style
+    needed to do so later is kept under 'style'.
     """
-    # Normal text only (always visible)
-    normal_txt = TextClip(
-        text=text_str,
-        font=normal_font,
-        font_size=normal_font_size,
-        color=normal_text_color,
-        stroke_color=normal_stroke_color,
-        stroke_width=normal_stroke_width,
-        bg_color = page_bg_color
-        # method="label"
-    )
-    nw, nh = normal_txt.size
-
-    # Highlight text (only visible during [w_start, w_end])
-    highlight_txt = TextClip(
-        text=text_str,
-        font=highlight_font,
-        font_size=highlight_font_size,
-        color=highlight_text_color,
-        stroke_color=highlight_stroke_color,
-        stroke_width=highlight_stroke_width,
-        # method="label"
-        bg_color = highlight_bg_color
-    )
-    hw, hh = highlight_txt.size
-    
-    # Highlight background
-    highlight_bg = create_rounded_background(
-        (hw + 2*padding, hh + 2*padding),
-        highlight_bg_color,
-        highlight_bg_radius
-    )
+    nw, nh = font_metrics(normal_font, normal_font_size, normal_stroke_width).text_size(text_str)
+    hw, hh = font_metrics(highlight_font, highlight_font_size, highlight_stroke_width).text_size(text_str)
 
-    # We'll store the bounding boxes for normal/highlight
-    word_info = {
+    return {
         'text': text_str,
         'start': w_start,
         'end': w_end,
 
-        'normal_txt': normal_txt,
         'normal_w': nw,
         'normal_h': nh,
-
-        'highlight_txt': highlight_txt,
-        'highlight_bg': highlight_bg,
         'highlight_w': hw + 2*padding,
-        'highlight_h': hh + 2*padding
+        'highlight_h': hh + 2*padding,
+
+        'style': {
+            'normal': (normal_font, normal_font_size, normal_text_color,
+                       normal_stroke_color, normal_stroke_width, page_bg_color),
+            'highlight': (highlight_font, highlight_font_size, highlight_text_color,
+                          highlight_stroke_color, highlight_stroke_width, highlight_bg_color),
+            'highlight_bg': (highlight_bg_color, highlight_bg_radius),
+        },
     }
+
+
+def rasterize_word_info(word_info):
+    """
+    Adds the cached RGBA sprites of a measured word:
+      - Normal text (no normal background).
+      - Highlight background + highlight text.
+    """
+    style = word_info['style']
+    bg_color, bg_radius = style['highlight_bg']
+    word_info['normal_rgba'] = text_sprite(word_info['text'], *style['normal'])
+    word_info['highlight_rgba'] = text_sprite(word_info['text'], *style['highlight'])
+    word_info['highlight_bg_rgba'] = rounded_rect_sprite(
+        (word_info['highlight_w'], word_info['highlight_h']), bg_color, bg_radius
+    )
     return word_info
 
 
+def word_clips(word_info):
+    """Adds the ImageClips of a rasterized word, as used by `build_page_clip`"""
+    word_info['normal_txt'] = sprite_clip(word_info['normal_rgba'])
+    word_info['highlight_txt'] = sprite_clip(word_info['highlight_rgba'])
+    word_info['highlight_bg'] = sprite_clip(word_info['highlight_bg_rgba'])
+    return word_info
+
+
+def prepare_word_info(*args, **kwargs):
+    """
+    Creates a complete 'word_info' dict for each word: sizes, sprites and clips.
+    Takes the arguments of `measure_word_info`.
+    """
+    return word_clips(rasterize_word_info(measure_word_info(*args, **kwargs)))
+
+
 # --------------------------------------------------------------------
 # 3) Line Wrapping
 # --------------------------------------------------------------------
@@ -178,22 +209,16 @@ def split_lines_into_pages(lines, max_lines_per_screen):
 
 
 # --------------------------------------------------------------------
-# 5) Building a CompositeVideoClip for a Single Page
+# 5) Page Layout (pure geometry, shared by every renderer)
 # --------------------------------------------------------------------
 
-def build_page_clip(
-    chunked_lines, 
-    chunk_start, chunk_end,
-    word_spacing, line_spacing, padding,
-    sub_position,
-    page_bg_color, page_bg_radius
-):
+def layout_page(chunked_lines, chunk_start, chunk_end, word_spacing, line_spacing, padding):
     """
-    Build a CompositeVideoClip for a single 'page' of lines.
-    Each word's normal text is always visible, highlight is shown 
-    only in [word.start - chunk_start, word.end - chunk_start].
-
-    We also create ONE big background rectangle for the entire page (like a 'sentence background').
+    Compute the geometry of a single 'page' of lines without building any clip.
+    Returns a dict with the page 'width'/'height' and, for every word, the
+    position of its normal text, highlight background and highlight text
+    (relative to the page) plus its highlight window [h_start, h_end)
+    relative to chunk_start (empty windows are None).
     """
     chunk_duration = chunk_end - chunk_start
 
@@ -230,22 +255,8 @@ def build_page_clip(
     if total_height > 0:
         total_height -= line_spacing
 
-    # 2) Create a single background for the entire page
-    page_bg_clip = None
-    if (max_width > 0) and (total_height > 0):
-        page_bg_clip = create_rounded_background(
-            (int(max_width), int(total_height)),
-            page_bg_color,
-            page_bg_radius
-        ).with_duration(chunk_duration)
-
-    # 3) Place normal text and highlight text
-    page_clips = []
-    if page_bg_clip:
-        # By default, keep the mask so corners are truly rounded
-        # If you want partial transparency, ensure alpha < 255 in `page_bg_color`.
-        page_clips.append(page_bg_clip)
-
+    # 2) Place normal text and highlight text
+    placed_words = []
     y_offset = 0
     for line in chunked_lines:
         line_max_h = 0
@@ -280,10 +291,6 @@ def build_page_clip(
             normal_text_x = x_offset + (box_w - w['normal_w'])/2
             normal_text_y = y_offset + (box_h - w['normal_h'])/2
 
-            normal_clip = w['normal_txt'].with_position((normal_text_x, normal_text_y))
-            normal_clip = normal_clip.with_duration(chunk_duration)
-            page_clips.append(normal_clip)
-
             # highlight time window
             h_start = w['start'] - chunk_start
             h_end   = w['end']   - chunk_start
@@ -292,25 +299,91 @@ def build_page_clip(
             h_start = max(0, h_start)
             h_end = min(chunk_duration, h_end)
 
-            if h_end > h_start:
-                # highlight background
-                highlight_bg_clip = w['highlight_bg'].with_position((x_offset, y_offset))
-                highlight_bg_clip = highlight_bg_clip.with_start(h_start).with_end(h_end)
-                page_clips.append(highlight_bg_clip)
+            # highlight text
+            highlight_text_x = x_offset + (box_w - w['highlight_w'])/2 + padding
+            highlight_text_y = y_offset + (box_h - w['highlight_h'])/2 + padding
 
-                # highlight text
-                highlight_text_x = x_offset + (box_w - w['highlight_w'])/2 + padding
-                highlight_text_y = y_offset + (box_h - w['highlight_h'])/2 + padding
-
-                highlight_txt_clip = w['highlight_txt'].with_position((highlight_text_x, highlight_text_y))
-                highlight_txt_clip = highlight_txt_clip.with_start(h_start).with_end(h_end)
-                page_clips.append(highlight_txt_clip)
+            placed_words.append({
+                'word': w,
+                'normal_pos': (normal_text_x, normal_text_y),
+                'highlight_bg_pos': (x_offset, y_offset),
+                'highlight_txt_pos': (highlight_text_x, highlight_text_y),
+                'h_window': (h_start, h_end) if h_end > h_start else None,
+            })
 
             x_offset += (box_w + word_spacing)
 
         y_offset += (line_max_h + line_spacing)
 
-    # 4) Create the CompositeVideoClip
+    return {
+        'width': max_width,
+        'height': total_height,
+        'duration': chunk_duration,
+        'words': placed_words,
+    }
+
+
+# --------------------------------------------------------------------
+# 6) Building a CompositeVideoClip for a Single Page
+# --------------------------------------------------------------------
+
+def build_page_clip(
+    chunked_lines, 
+    chunk_start, chunk_end,
+    word_spacing, line_spacing, padding,
+    sub_position,
+    page_bg_color, page_bg_radius
+):
+    """
+    Build a CompositeVideoClip for a single 'page' of lines.
+    Each word's normal text is always visible, highlight is shown 
+    only in [word.start - chunk_start, word.end - chunk_start].
+
+    We also create ONE big background rectangle for the entire page (like a 'sentence background').
+    """
+    layout = layout_page(chunked_lines, chunk_start, chunk_end, word_spacing, line_spacing, padding)
+    chunk_duration = layout['duration']
+    max_width = layout['width']
+    total_height = layout['height']
+
+    # 1) Create a single background for the entire page
+    page_bg_clip = None
+    if (max_width > 0) and (total_height > 0):
+        page_bg_clip = create_rounded_background(
+            (int(max_width), int(total_height)),
+            page_bg_color,
+            page_bg_radius
+        ).with_duration(chunk_duration)
+
+    # 2) Place normal text and highlight text
+    page_clips = []
+    if page_bg_clip:
+        # By default, keep the mask so corners are truly rounded
+        # If you want partial transparency, ensure alpha < 255 in `page_bg_color`.
+        page_clips.append(page_bg_clip)
+
+    for placed in layout['words']:
+        w = placed['word']
+
+        # Normal text always visible
+        normal_clip = w['normal_txt'].with_position(placed['normal_pos'])
+        normal_clip = normal_clip.with_duration(chunk_duration)
+        page_clips.append(normal_clip)
+
+        if placed['h_window'] is not None:
+            h_start, h_end = placed['h_window']
+
+            # highlight background
+            highlight_bg_clip = w['highlight_bg'].with_position(placed['highlight_bg_pos'])
+            highlight_bg_clip = highlight_bg_clip.with_start(h_start).with_end(h_end)
+            page_clips.append(highlight_bg_clip)
+
+            # highlight text
+            highlight_txt_clip = w['highlight_txt'].with_position(placed['highlight_txt_pos'])
+            highlight_txt_clip = highlight_txt_clip.with_start(h_start).with_end(h_end)
+            page_clips.append(highlight_txt_clip)
+
+    # 3) Create the CompositeVideoClip
     page_comp = CompositeVideoClip(page_clips, size=(int(max_width), int(total_height)))
     page_comp = page_comp.with_duration(chunk_duration).with_start(chunk_start)
     page_comp = page_comp.with_position(('center', sub_position))
@@ -319,10 +392,10 @@ def build_page_clip(
 
 
 # --------------------------------------------------------------------
-# 6) Main Function: create_subtitles
+# 7) Paging: word infos, lines and page timings for a whole script
 # --------------------------------------------------------------------
 
-def create_subtitles(
+def layout_subtitles(
     aligned_data,
     video_height,
     sub_position_percentage = 0,
@@ -352,14 +425,17 @@ def create_subtitles(
     # Layout/padding
     word_spacing=0,
     line_spacing=5,
-    padding=5
+    padding=5,
+
+    rasterize=True
 ):
     """
-    Creates a list of subtitle 'pages' as CompositeVideoClips, each containing
-    multiple lines. Instead of giving each word a normal background, we draw
-    ONE big background rectangle for the entire page (like a 'sentence' or 
-    'paragraph' background). Meanwhile, each word can still have a highlight
-    background that appears only during [word.start, word.end].
+    Splits every segment of `aligned_data` into subtitle 'pages' of wrapped
+    lines and returns them as plain dicts: the page lines, its time window
+    [start, end], the vertical position, the page background style and the
+    `layout_page` geometry. Every subtitle renderer starts from this list.
+    Wrapping, paging and placement only use the font metrics; the words are
+    rasterized afterwards, and not at all with `rasterize=False`.
     """
     subtitle_height = (highlight_font_size + 2 * padding) * max_lines_per_screen
     sub_position = video_height * sub_position_percentage / 100
@@ -367,17 +443,17 @@ def create_subtitles(
     if sub_position + subtitle_height > video_height:
         sub_position = video_height - subtitle_height
 
-    subtitle_clips = []
+    subtitle_pages = []
 
     for segment in aligned_data:
         words = segment.get('words', [])
         if not words:
             continue
 
-        # Prepare word infos for the entire segment
+        # Measure word infos for the entire segment
         word_infos = []
         for w in words:
-            w_info = prepare_word_info(
+            w_info = measure_word_info(
                 text_str=w['text'],
                 w_start=w['start'],
                 w_end=w['end'],
@@ -412,17 +488,89 @@ def create_subtitles(
             chunk_start = min(min(w['start'] for w in line) for line in page_lines)
             chunk_end   = max(max(w['end']   for w in line) for line in page_lines)
 
-            page_clip = build_page_clip(
-                chunked_lines=page_lines,
-                chunk_start=chunk_start,
-                chunk_end=chunk_end,
-                word_spacing=word_spacing,
-                line_spacing=line_spacing,
-                padding=padding,
-                sub_position=sub_position,
-                page_bg_color=page_bg_color,
-                page_bg_radius=page_bg_radius
-            )
-            subtitle_clips.append(page_clip)
+            subtitle_pages.append({
+                'lines': page_lines,
+                'start': chunk_start,
+                'end': chunk_end,
+                'sub_position': sub_position,
+                'word_spacing': word_spacing,
+                'line_spacing': line_spacing,
+                'padding': padding,
+                'bg_color': page_bg_color,
+                'bg_radius': page_bg_radius,
+                'layout': layout_page(page_lines, chunk_start, chunk_end,
+                                      word_spacing, line_spacing, padding),
+            })
+
+    if rasterize:
+        for page in subtitle_pages:
+            for line in page['lines']:
+                for w in line:
+                    rasterize_word_info(w)
+        print("subtitle sprite cache: ", SPRITE_CACHE.stats())
+    return subtitle_pages
+
+
+# --------------------------------------------------------------------
+# 8) Main Function: create_subtitles
+# --------------------------------------------------------------------
+
+def create_subtitles(aligned_data, video_height, sub_position_percentage=0, **style):
+    """
+    Creates a list of subtitle 'pages' as CompositeVideoClips, each containing
+    multiple lines. Instead of giving each word a normal background, we draw
+    ONE big background rectangle for the entire page (like a 'sentence' or 
+    'paragraph' background). Meanwhile, each word can still have a highlight
+    background that appears only during [word.start, word.end].
+    `style` accepts the keyword arguments of `layout_subtitles`.
+    """
+    subtitle_clips = []
+    for page in layout_subtitles(aligned_data, video_height, sub_position_percentage, **style):
+        for line in page['lines']:
+            for w in line:
+                word_clips(w)
+        page_clip = build_page_clip(
+            chunked_lines=page['lines'],
+            chunk_start=page['start'],
+            chunk_end=page['end'],
+            word_spacing=page['word_spacing'],
+            line_spacing=page['line_spacing'],
+            padding=page['padding'],
+            sub_position=page['sub_position'],
+            page_bg_color=page['bg_color'],
+            page_bg_radius=page['bg_radius']
+        )
+        subtitle_clips.append(page_clip)
 
     return subtitle_clips
+
+
+# --------------------------------------------------------------------
+# 9) Style scaling (preview renders)
+# --------------------------------------------------------------------
+
+# layout_subtitles arguments measured in pixels
+SCALED_STYLE_KEYS = (
+    "max_line_width",
+    "normal_font_size", "normal_stroke_width",
+    "highlight_font_size", "highlight_stroke_width", "highlight_bg_radius",
+    "page_bg_radius", "word_spacing", "line_spacing", "padding",
+)
+
+
+def scaled_style(scale, **style):
+    """
+    `layout_subtitles` style keyword arguments (defaults updated with `style`)
+    with every pixel measure multiplied by `scale`, so a page laid out on a
+    canvas `scale` times the size looks like the full-size one.
+    Non-zero sizes never drop below one pixel.
+    """
+    params = inspect.signature(layout_subtitles).parameters
+    scaled = {name: p.default for name, p in params.items()
+              if p.default is not inspect.Parameter.empty
+              and name not in ("sub_position_percentage", "rasterize")}
+    scaled.update(style)
+    for key in SCALED_STYLE_KEYS:
+        value = scaled[key]
+        scaled[key] = max(1, round(value * scale)) if value else value
+    return scaled
@@ -0,0 +1,118 @@
+#############################
+# tracing.py
+#############################
+# Lightweight per-stage instrumentation. Every `span` records wall time, CPU
+# time of this process and of its finished children (ffmpeg), peak RSS and,
+# when the stage reports a frame count, frames per second. The spans can be
+# written as a Chrome-trace / Perfetto JSON file (chrome://tracing,
+# ui.perfetto.dev) and summarised on one line.
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, None when unavailable"""
+    if resource is not None:
+        # ru_maxrss is in KB on Linux and in bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if os.uname().sysname == "Darwin" else peak / 1024
+    if psutil is not None:
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / (1024 * 1024)
+    return None
+
+
+def _children_cpu():
+    times = os.times()
+    return times.children_user + times.children_system
+
+
+class Tracer:
+    """Collects complete ("X") trace events for the spans of one process"""
+
+    def __init__(self):
+        self.events = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name, **args):
+        """
+        Time the body of the `with` block. Yields the event's args dict so the
+        stage can attach results; setting args['frames'] adds a fps figure.
+        """
+        info = dict(args)
+        ts = time.time()
+        wall0, cpu0, child0 = time.perf_counter(), time.process_time(), _children_cpu()
+        try:
+            yield info
+        finally:
+            wall = time.perf_counter() - wall0
+            info['wall_s'] = round(wall, 6)
+            info['cpu_s'] = round(time.process_time() - cpu0, 6)
+            info['child_cpu_s'] = round(_children_cpu() - child0, 6)
+            info['peak_rss_mb'] = peak_rss_mb()
+            if info.get('frames') and wall > 0:
+                info['fps'] = round(info['frames'] / wall, 2)
+            event = {
+                'name': name,
+                'ph': 'X',
+                'ts': ts * 1e6,
+                'dur': wall * 1e6,
+                'pid': os.getpid(),
+                'tid': threading.get_ident(),
+                'args': info,
+            }
+            with self._lock:
+                self.events.append(event)
+
+    def drain(self):
+        """Return the recorded events and start over (used by pool workers)"""
+        with self._lock:
+            events, self.events = self.events, []
+        return events
+
+    def write_chrome_trace(self, path, events=None):
+        """Write `events` (default: this tracer's) as Chrome-trace JSON"""
+        events = self.events if events is None else events
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump({'traceEvents': sorted(events, key=lambda e: e['ts']), 'displayTimeUnit': 'ms'}, f)
+        return path
+
+    def summary(self, events=None):
+        """One-line summary: stage wall times, fps where known and peak RSS"""
+        events = self.events if events is None else events
+        if not events:
+            return "trace: no spans recorded"
+        parts = []
+        for event in sorted(events, key=lambda e: e['ts']):
+            args = event['args']
+            part = f"{event['name']} {args['wall_s']:.2f}s"
+            if 'fps' in args:
+                part += f" ({args['fps']:.0f} fps)"
+            parts.append(part)
+        peaks = [e['args']['peak_rss_mb'] for e in events if e['args']['peak_rss_mb'] is not None]
+        if peaks:
+            parts.append(f"peak rss {max(peaks):.0f} MB")
+        return "trace: " + " | ".join(parts)
+
+
+TRACER = Tracer()
+
+
+def span(name, **args):
+    """`Tracer.span` on the process-wide tracer"""
+    return TRACER.span(name, **args)
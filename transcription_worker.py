@@ -0,0 +1,222 @@
+#############################
+# transcription_worker.py
+#############################
+# Long-lived local transcription service. The Whisper model is loaded once per
+# replica process and stays resident; clients send jobs over a local socket.
+# Both sides authenticate with a random per-user key, and only plain data is
+# exchanged (a JSON header, raw float32 samples and a JSON reply), never pickles.
+#
+#   python transcription_worker.py --replicas 2 --model medium
+#
+import argparse
+import json
+import os
+import secrets
+import threading
+from multiprocessing import AuthenticationError, Pool
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+DEFAULT_WORKER_ADDRESS = ("127.0.0.1", 6123)
+# per-user key shared by the worker and its clients, unless SHORTGEN_WORKER_AUTHKEY is set
+WORKER_KEY_PATH = os.path.join(os.path.expanduser("~"), ".short_gen", "worker.key")
+CONNECT_TIMEOUT = 5.0
+# seconds a client waits for a transcription before doing it in-process
+WORKER_TIMEOUT = float(os.environ.get("SHORTGEN_WORKER_TIMEOUT", 900))
+MAX_HEADER_BYTES = 1 << 20
+MAX_SAMPLES = 16000 * 60 * 60 * 4
+
+_model = None
+
+
+def worker_address():
+    """Worker address from SHORTGEN_WORKER_ADDRESS ("host:port") or the default"""
+    value = os.environ.get("SHORTGEN_WORKER_ADDRESS")
+    if not value:
+        return DEFAULT_WORKER_ADDRESS
+    host, port = value.rsplit(":", 1)
+    return (host, int(port))
+
+
+def worker_authkey(create=False):
+    """
+    Authentication key of the worker: SHORTGEN_WORKER_AUTHKEY (hex) or the
+    contents of WORKER_KEY_PATH. With `create`, a random key is written to that
+    file (mode 0600, directory 0700) when there is none yet. Returns None when
+    no key exists, i.e. no worker was ever started by this user.
+    """
+    value = os.environ.get("SHORTGEN_WORKER_AUTHKEY")
+    if value:
+        return bytes.fromhex(value)
+    try:
+        with open(WORKER_KEY_PATH, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        if not create:
+            return None
+    os.makedirs(os.path.dirname(WORKER_KEY_PATH), mode=0o700, exist_ok=True)
+    key = secrets.token_bytes(32)
+    try:
+        fd = os.open(WORKER_KEY_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        return worker_authkey()
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    return key
+
+
+def _json_default(value):
+    # numpy scalars and arrays in Whisper results
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _send_json(conn, value):
+    conn.send_bytes(json.dumps(value, default=_json_default).encode("utf-8"))
+
+
+def _load_model(model_name, threads):
+    """Pool initializer: load the model once for the lifetime of the replica"""
+    global _model
+    import torch
+    from audio_processor import load_whisper_model
+
+    torch.set_num_threads(threads)
+    _model = load_whisper_model(model_name)
+
+
+def _transcribe(audio, options):
+    return _model.transcribe(audio, **options)
+
+
+def _read_request(conn):
+    """(audio, options, model) of a request: a JSON header, then the float32 samples if any"""
+    if not conn.poll(CONNECT_TIMEOUT):
+        raise ValueError("no request received")
+    request = json.loads(conn.recv_bytes(MAX_HEADER_BYTES))
+    options, n_samples = request.get("options"), request.get("samples")
+    if not isinstance(options, dict):
+        raise ValueError("options must be an object")
+    if n_samples is None:
+        audio = request.get("audio")
+        if not isinstance(audio, str):
+            raise ValueError("audio must be a file path")
+    else:
+        if not isinstance(n_samples, int) or not 0 < n_samples <= MAX_SAMPLES:
+            raise ValueError(f"invalid sample count {n_samples!r}")
+        if not conn.poll(CONNECT_TIMEOUT):
+            raise ValueError("no samples received")
+        audio = np.frombuffer(conn.recv_bytes(n_samples * 4), dtype=np.float32)
+        if len(audio) != n_samples:
+            raise ValueError("sample count does not match the header")
+    return audio, options, request.get("model")
+
+
+def _handle(conn, pool, model_name):
+    try:
+        try:
+            audio, options, model = _read_request(conn)
+        except (ValueError, TypeError) as e:
+            _send_json(conn, {"error": f"bad request: {e}"})
+            return
+        if model != model_name:
+            _send_json(conn, {"unsupported": f"worker serves '{model_name}', not '{model}'"})
+            return
+        result = pool.apply(_transcribe, (audio, options))
+        _send_json(conn, {"result": result})
+    except (EOFError, OSError):
+        pass
+    except Exception as e:
+        _send_json(conn, {"error": repr(e)})
+    finally:
+        conn.close()
+
+
+def serve(address=None, replicas=1, model_name="medium"):
+    """Run the worker until interrupted, with `replicas` resident model copies"""
+    address = address or worker_address()
+    threads = max(1, (os.cpu_count() or 1) // replicas)
+    pool = Pool(replicas, initializer=_load_model, initargs=(model_name, threads))
+    print(f"transcription worker: {replicas} x whisper '{model_name}' listening on {address[0]}:{address[1]}")
+    try:
+        with Listener(address, authkey=worker_authkey(create=True)) as listener:
+            while True:
+                try:
+                    conn = listener.accept()
+                except (AuthenticationError, EOFError, OSError):
+                    continue
+                threading.Thread(target=_handle, args=(conn, pool, model_name), daemon=True).start()
+    finally:
+        pool.terminate()
+
+
+def _connect(address, authkey, timeout=CONNECT_TIMEOUT):
+    """Authenticated connection to the worker, None if none answers within `timeout`"""
+    result = []
+
+    def connect():
+        try:
+            result.append(Client(address, authkey=authkey))
+        except (AuthenticationError, EOFError, OSError):
+            pass
+
+    # the handshake blocks on reads, a listener that never answers must not hang the render
+    thread = threading.Thread(target=connect, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return result[0] if result else None
+
+
+def transcribe_remote(audio, options, model_name, address=None, timeout=WORKER_TIMEOUT):
+    """
+    Send a transcription job to the resident worker.
+    `audio` is a file path (resolved to an absolute path) or a float32 sample array.
+    Returns the Whisper result dict, or None when no worker is reachable, the
+    worker serves a different model or does not answer within `timeout` seconds.
+    """
+    authkey = worker_authkey()
+    if authkey is None:
+        return None
+    conn = _connect(address or worker_address(), authkey)
+    if conn is None:
+        return None
+
+    with conn:
+        try:
+            if isinstance(audio, str):
+                _send_json(conn, {"audio": os.path.abspath(audio), "options": options, "model": model_name})
+            else:
+                samples = np.ascontiguousarray(audio, dtype=np.float32)
+                _send_json(conn, {"samples": len(samples), "options": options, "model": model_name})
+                conn.send_bytes(memoryview(samples).cast("B"))
+            if not conn.poll(timeout):
+                print(f"transcription worker did not answer within {timeout:.0f}s, transcribing in-process")
+                return None
+            reply = json.loads(conn.recv_bytes())
+        except (EOFError, OSError):
+            return None
+
+    if "unsupported" in reply:
+        print("transcription worker skipped: ", reply["unsupported"])
+        return None
+    if "error" in reply:
+        raise RuntimeError(f"transcription worker failed: {reply['error']}")
+    return reply["result"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Resident Whisper transcription worker')
+    parser.add_argument('--host', type=str, default=None, help='Listen address (default from SHORTGEN_WORKER_ADDRESS)')
+    parser.add_argument('--port', type=int, default=None, help='Listen port')
+    parser.add_argument('--replicas', type=int, default=1, help='Number of resident model replicas')
+    parser.add_argument('--model', type=str, default="medium", help='Whisper model name')
+    args = parser.parse_args()
+
+    host, port = worker_address()
+    serve((args.host or host, args.port or port), args.replicas, args.model)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,11 @@
 #############################
 # utils.py
 #############################
+import json
 import os
-from moviepy.audio.io.AudioFileClip import AudioFileClip
-
-import os
+import re
+import subprocess
+import wave
 
 def validate_inputs(input_dir):
     """Validate input files existence and format"""
@@ -31,15 +32,20 @@ def validate_inputs(input_dir):
     foreaudio_dir = None
     backauido_dir = None
     
-    for f in os.listdir(audio_dir):
-        file_path = os.path.join(audio_dir, f)
-        if os.path.isfile(file_path) and os.path.splitext(f)[1].lower() in allowed_audio_formats:
-            # Check filename for voiceover or background
-            filename = os.path.splitext(f)[0].lower()
-            if "voiceover" in filename or "voice" in filename:
-                foreaudio_dir = file_path
-            elif "background" in filename or "bg" in filename:
-                backauido_dir = file_path
+    audio_files = [os.path.join(audio_dir, f) for f in sorted(os.listdir(audio_dir))
+                   if os.path.splitext(f)[1].lower() in allowed_audio_formats]
+    audio_files = [path for path in audio_files if os.path.isfile(path)]
+    if not audio_files:
+        print("No valid audio file found in the audio directory")
+        return None
+
+    for file_path in audio_files:
+        # Check filename for voiceover or background
+        filename = os.path.splitext(os.path.basename(file_path))[0].lower()
+        if "voiceover" in filename or "voice" in filename:
+            foreaudio_dir = file_path
+        elif "background" in filename or "bg" in filename:
+            backauido_dir = file_path
     
     if foreaudio_dir is None:
         print("No voiceover audio file found")
@@ -49,24 +55,83 @@ def validate_inputs(input_dir):
         print("No background audio file found")
         # return None
 
-    audio_dir_file = None
-    for f in os.listdir(audio_dir):
-        file_path = os.path.join(audio_dir, f)
-        if os.path.isfile(file_path) and os.path.splitext(f)[1].lower() in allowed_audio_formats:
-            audio_dir_file = file_path
-    
-    if audio_dir_file is None:
-        print("No valid audio file found in the audio directory")
-        return None
-
     return [image_dir, foreaudio_dir, backauido_dir, script_path]
 
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg')
+
+
+def list_images(image_dir):
+    """Image files of `image_dir` sorted by their numeric name (1.png, 2.jpg, ... 10.png)"""
+    def sort_key(path):
+        name = os.path.splitext(os.path.basename(path))[0]
+        return (int(name), name) if name.isdigit() else (float("inf"), name)
+
+    images = [os.path.join(image_dir, f) for f in os.listdir(image_dir)
+              if f.lower().endswith(IMAGE_EXTENSIONS)]
+    return sorted(images, key=sort_key)
+
+
+def _wav_info(audio_path):
+    with wave.open(audio_path, "rb") as wav:
+        return {
+            'duration': wav.getnframes() / wav.getframerate(),
+            'sample_rate': wav.getframerate(),
+            'channels': wav.getnchannels(),
+        }
+
+
+def _ffprobe_info(audio_path):
+    out = subprocess.run(
+        ["ffprobe", "-v", "error", "-select_streams", "a:0",
+         "-show_entries", "format=duration:stream=sample_rate,channels", "-of", "json", audio_path],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    info = json.loads(out)
+    stream = (info.get("streams") or [{}])[0]
+    return {
+        'duration': float(info["format"]["duration"]),
+        'sample_rate': int(stream.get("sample_rate", 0)) or None,
+        'channels': stream.get("channels"),
+    }
+
+
+def _ffmpeg_info(audio_path):
+    # ffmpeg without an output prints the stream header and exits with an error
+    err = subprocess.run(["ffmpeg", "-hide_banner", "-i", audio_path], capture_output=True, text=True).stderr
+    duration = re.search(r"Duration: (\d+):(\d+):([\d.]+)", err)
+    stream = re.search(r"Audio: [^\n]*?(\d+) Hz, (mono|stereo|\d+ channels)?", err)
+    if duration is None:
+        raise ValueError(f"Could not read the duration of {audio_path}")
+    h, m, s = duration.groups()
+    channels = None
+    if stream and stream.group(2):
+        channels = {"mono": 1, "stereo": 2}.get(stream.group(2)) or int(stream.group(2).split()[0])
+    return {
+        'duration': int(h) * 3600 + int(m) * 60 + float(s),
+        'sample_rate': int(stream.group(1)) if stream else None,
+        'channels': channels,
+    }
+
+
+def audio_info(audio_path):
+    """
+    Duration (seconds), sample rate and channel count of an audio file, read
+    from the WAV header or with ffprobe, without decoding the samples
+    """
+    if audio_path.lower().endswith(".wav"):
+        try:
+            return _wav_info(audio_path)
+        except (wave.Error, EOFError):
+            pass  # e.g. float or extensible WAV, let ffprobe read it
+    try:
+        return _ffprobe_info(audio_path)
+    except (OSError, subprocess.CalledProcessError, KeyError, ValueError):
+        return _ffmpeg_info(audio_path)
+
+
 def check_audio_duration(audio_path):
     """Check audio duration and warn if too long"""
-    audio = AudioFileClip(audio_path)
-    duration = audio.duration
-    audio.close()
-    return duration
+    return audio_info(audio_path)['duration']
 
 def time_to_seconds(time_obj):
     """Convert datetime.time object to total seconds"""
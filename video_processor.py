@@ -2,18 +2,40 @@
 # video_processor.py (Updated for MoviePy 2.1.1)
 #############################
 from moviepy.video.VideoClip import ImageClip, TextClip
-from moviepy.video.compositing.CompositeVideoClip import CompositeVideoClip, CompositeAudioClip
-from moviepy.audio.io.AudioFileClip import AudioFileClip
 from moviepy.video.compositing.CompositeVideoClip import concatenate_videoclips
-from subtitles import create_subtitles
+from subtitle_overlay import SubtitleOverlay, create_subtitle_overlay
+from subtitles import layout_subtitles, scaled_style
+from ass_export import subtitles_filter, write_ass
+from span_renderer import StaticSpanRenderer, change_points
+from encoder import encode_frames, encoder_profile, rendition_path
+from audio_mix import mix_audio, mix_ducked
+from image_cache import image_size, prepare_images
+from utils import list_images
+from tracing import span
+from segment_render import (SEGMENT_CACHE, concat_segments, first_frame_at, render_segments,
+                            segment_frame_ranges, segment_key)
+from cache import file_digest
+from workspace import Workspace
 
+import numpy as np
 import os
-import subprocess
+from bisect import bisect_right
 
-def create_image_clips(image_dir, aligned_data):
-    """Create image clips with proper sequencing and duration"""
-    images = sorted([os.path.join(image_dir, f) for f in os.listdir(image_dir)], 
-                   key=lambda x: int(os.path.splitext(os.path.basename(x))[0]))
+# --preview: canvas height, and encoder settings that replace the profile's
+PREVIEW_HEIGHT = 640
+PREVIEW_ENCODER = {'fps': 12, 'preset': 'ultrafast', 'crf': 30}
+# overlay: numpy compositing, ass: libass burn-in of an exported .ass file
+SUBTITLE_RENDERERS = ("overlay", "ass")
+
+def create_image_clips(images, aligned_data, size, fit="crop", image_digests=None):
+    """Create image clips with proper sequencing and duration
+    images: image paths in display order (utils.list_images)
+    size: (width, height) of the output canvas, every image is fitted to it once
+    fit: "crop", "letterbox" or "stretch" (see image_cache.fit_image)
+    image_digests: sha256 of every image when already known (see probe.py)
+    """
+    images = images[:len(aligned_data)]
+    frames = prepare_images(images, size, fit, digests=image_digests)
     
     clips = []
     test_start = [0,4.56,9.82,6]
@@ -26,7 +48,7 @@ def create_image_clips(image_dir, aligned_data):
         # clip = clip.with_duration(test_durations[idx])
         duration = segment['end'] - segment['start']        
         print(f"Segment {idx}: Start={segment['start']}, End={segment['end']}, Duration={duration}")
-        clip = ImageClip(images[idx]).with_start(segment['start'],change_end=False)
+        clip = ImageClip(frames[idx]).with_start(segment['start'],change_end=False)
         if(idx == len(aligned_data)-1):
             #final clip end with last segment end
             clip = clip.with_end(segment['end'])
@@ -48,84 +70,284 @@ def create_image_clips(image_dir, aligned_data):
     
     return concatenate_videoclips(clips, method="chain")#"chain")
 
-def process_video(image_dir, script_path, audio_data, output_path, sub_position, playback_speed, background_volume=0.3):
+def base_frame(video_clip, size, t):
+    """
+    Frame of the image track at time `t` on a black canvas of `size`,
+    the way CompositeVideoClip lays the first clip over its background.
+    """
+    w, h = size
+    if not video_clip.is_playing(t):
+        return np.zeros((h, w, 3), dtype=np.uint8)
+
+    frame = np.asarray(video_clip.get_frame(t), dtype=np.uint8)
+    if video_clip.mask is None and frame.shape[:2] == (h, w):
+        return frame
+
+    canvas = np.zeros((h, w, 3), dtype=np.uint8)
+    fh, fw = min(h, frame.shape[0]), min(w, frame.shape[1])
+    frame = frame[:fh, :fw]
+    if video_clip.mask is not None:
+        alpha = (video_clip.mask.get_frame(t) * 255).astype(np.int32)[:fh, :fw, None]
+        tmp = frame.astype(np.int32) * alpha + 128
+        frame = ((tmp + (tmp >> 8)) >> 8).astype(np.uint8)
+    canvas[:fh, :fw] = frame
+    return canvas
+
+
+def build_renderer(images, aligned_data, sub_position, resolution, fit="crop", subtitle_style=None,
+                   draw_subtitles=True, image_digests=None):
+    """
+    Subtitle overlay, image track and the span renderer composing them.
+    Returns (renderer, video_clip, subtitles). Segment render workers call this
+    too, so every process builds exactly the same timeline.
+    subtitle_style: keyword arguments for subtitles.layout_subtitles
+    draw_subtitles: False leaves the overlay empty (subtitles burnt in by ffmpeg)
+    images, image_digests: see create_image_clips
+    """
+    with span("create_subtitles"):
+        if draw_subtitles:
+            subtitles = create_subtitle_overlay(aligned_data, resolution[1], sub_position, **(subtitle_style or {}))
+        else:
+            subtitles = SubtitleOverlay([])
+
+    with span("create_image_clips"):
+        video_clip = create_image_clips(images, aligned_data, resolution, fit, image_digests)
+
+    # Combine subtitles over the video: the overlay blits the active page and
+    # highlight onto each image frame instead of walking a clip tree, and each
+    # static span between two change points is only composed once
+    video_size = tuple(resolution)
+    renderer = StaticSpanRenderer(
+        lambda t: subtitles.render(base_frame(video_clip, video_size, t), t),
+        change_points(video_clip, subtitles)
+    )
+    return renderer, video_clip, subtitles
+
+
+def segment_keys(ranges, images, video_clip, subtitles, size, fps, playback_speed, encoder, fit,
+                 image_digests=None):
+    """
+    Render cache key of every (first, last) frame range: the bytes of the
+    image on screen, the subtitle pages visible in the range (see
+    SubtitleOverlay.fingerprint), the frame range itself and the output settings.
+    """
+    digests = dict(zip(images, image_digests or []))
+    keys = []
+    for first, last in ranges:
+        t0, t1 = first / fps * playback_speed, (last - 1) / fps * playback_speed
+        idx = bisect_right(video_clip.timings, t0) - 1
+        image = images[idx] if t0 < video_clip.end and 0 <= idx < len(images) else None
+        if image is not None and image not in digests:
+            digests[image] = file_digest(image)
+        keys.append(segment_key(first, last, digests.get(image), subtitles.fingerprint(t0, t1),
+                                size, fps, playback_speed, encoder, fit))
+    return keys
+
+
+def process_video(image_dir, script_path, audio_data, output_path, sub_position, playback_speed, background_volume=0.3,
+                  encoder=None, resolution=None, fit="crop", segment_workers=1, incremental=False,
+                  preview=False, time_range=None, segment=None, scratch_in_ram=False, progress=None,
+                  subtitle_renderer="overlay", manifest=None, renditions=None, ducking=None):
     """Main video processing function
     playback_speed: Speedup factor for the final video 0.0 to 2.0
     sub_position: Float value between 0-100 representing vertical position as percentage
     background_volume: Float value between 0-1 representing the volume of the background audio
+    encoder: encoder profile dict (see encoder.encoder_profile): fps, crf, preset, tune, threads, gop, pix_fmt
+    resolution: (width, height) of the output video, None keeps the size of the first image
+    fit: how images with another aspect ratio are fitted: "crop", "letterbox" or "stretch"
+    segment_workers: > 1 renders the segments between image changes in that many
+    processes and joins them without re-encoding
+    incremental: render in segments and reuse the ones whose images, subtitles,
+    timings and encoder settings did not change since an earlier run
+    preview: draft render, the canvas and every subtitle measure are scaled down
+    to PREVIEW_HEIGHT and PREVIEW_ENCODER replaces the encoder speed settings
+    time_range: (start, end) in output seconds, only this part is rendered
+    segment: index of the image segment to render, instead of a time range
+    scratch_in_ram: keep the job's intermediate files on tmpfs (/dev/shm)
+    progress: called with (frames done, frames to render) while encoding
+    subtitle_renderer: "overlay" composes the subtitles in numpy, "ass" writes them
+    to `<output>.ass` and burns that file in with ffmpeg's subtitles filter (libass)
+    manifest: project manifest from probe.probe_project; image order, sizes and
+    hashes are taken from it instead of listing and reading the image directory
+    renditions: extra outputs (see encoder.rendition), scaled and encoded from
+    the same composed frames by the same ffmpeg process; files without an
+    output path are written next to `output_path` (see encoder.rendition_path)
+    ducking: ducking parameters (see audio_mix.ducking_profile), the background
+    is lowered while the voice speaks and crossfade-looped; None mixes it at a
+    flat background_volume
     """
+    encoder = encoder or encoder_profile()
+    if not playback_speed > 0:
+        raise ValueError(f"Invalid playback speed {playback_speed}, expected a positive number")
+    if subtitle_renderer not in SUBTITLE_RENDERERS:
+        raise ValueError(f"Unknown subtitle renderer '{subtitle_renderer}', expected one of {SUBTITLE_RENDERERS}")
+    burn_ass = subtitle_renderer == "ass"
+
     # Clamp sub_position to valid range (0-100)
     sub_position = max(0, min(100, float(sub_position)))
     
-    # Get video dimensions from the first image (to determine subtitle positions, etc.)
-    first_image_path = sorted([os.path.join(image_dir, f) for f in os.listdir(image_dir)])[0]
-    video_clip = ImageClip(first_image_path)
-    video_height = video_clip.size[1]
-    
-    # Create actual subtitles with correct position
-    subtitles = create_subtitles(audio_data['aligned_data'], video_height, sub_position)
-    
-    # Prepare temp audio file for speed-adjusted audio
-    temp_audio = "temp/speedup_audio.mp3"
-    if os.path.exists(temp_audio):
-        os.remove(temp_audio)
+    # Get video dimensions (to determine subtitle positions, etc.), by default
+    # from the header of the first image
+    if manifest is not None:
+        images = [image['path'] for image in manifest['images']]
+        image_digests = [image['sha256'] for image in manifest['images']]
+    else:
+        images, image_digests = list_images(image_dir), None
+    if resolution is None:
+        resolution = tuple(manifest['images'][0]['size']) if manifest is not None else image_size(images[0])
+
+    subtitle_style = None
+    if preview:
+        # Same layout at a fraction of the size: scale the canvas (even sizes
+        # for yuv420p) and every subtitle measure, encode fewer frames faster
+        scale = min(1.0, PREVIEW_HEIGHT / resolution[1])
+        resolution = (max(2, round(resolution[0] * scale / 2) * 2), max(2, round(resolution[1] * scale / 2) * 2))
+        subtitle_style = scaled_style(scale)
+        encoder = dict(encoder, **PREVIEW_ENCODER)
+        print(f"preview render at {resolution[0]}x{resolution[1]}, {encoder['fps']} fps")
+    video_size = tuple(resolution)
+
+    if renditions and preview:
+        print("preview renders only the main output, renditions are skipped")
+        renditions = None
+    renditions = [dict(item, output=item['output'] or rendition_path(output_path, item['size']))
+                  for item in renditions or []]
     
     # Ensure output directories exist
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    
-    # Build the main clip from all images
-    video_clip = create_image_clips(image_dir, audio_data['aligned_data'])
-
-    # Combine subtitles over the video
-    final_video = CompositeVideoClip([video_clip] + subtitles)
-
-    # Step 1: Generate speed-adjusted main audio
-    speedup_command = [
-        "ffmpeg", "-i", audio_data['raw_audio_path'], 
-        "-filter:a", f"atempo={playback_speed}", 
-        "-vn", temp_audio
-    ]
-    subprocess.run(speedup_command, check=True)
-
-    # Step 2: Adjust the video speed (visual only)
-    final_video = final_video.with_speed_scaled(playback_speed)
-
-    # Step 3: Now load the speed-adjusted (foreground) audio
-    foreground_audio = AudioFileClip(temp_audio)
-    background_audio_path = audio_data['background_music_path']
-
-    # Prepare background audio if provided
-    if background_audio_path is not None and os.path.exists(background_audio_path):
-        print("background audio path exists")
-        background_audio = AudioFileClip(background_audio_path)
-
-        # Trim or loop the background audio to match final video duration
-        # (Here we do a simple trim, but you can do more advanced logic if needed)
-        final_duration = final_video.duration
-        background_audio = background_audio.subclipped(0, min(background_audio.duration, final_duration))
-        # Optionally adjust background volume. E.g., 0.3 (30% volume)
-        background_audio = background_audio.with_volume_scaled(background_volume)
-        # Step 4: Mix foreground + background
-        mixed_audio = CompositeAudioClip([foreground_audio, background_audio])
-    else:
-        # No background audio, just use the foreground audio
-        mixed_audio = foreground_audio
-
-    # Attach the mixed audio to the final video
-    final_video = final_video.with_audio(mixed_audio)
-
-    # Step 5: Write the output video
-    final_video.write_videofile(
-        output_path,
-        codec='libx264',
-        audio_codec='aac',
-        fps=24,
-        threads=4,
-        preset='fast'
-    )
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+
+    # Intermediate files live in a private scratch directory that is removed
+    # even when the render fails, so concurrent jobs never share a file
+    with Workspace(in_memory=scratch_in_ram) as workspace:
+        temp_mix = workspace.file("mixed_audio.wav")
 
-    # Cleanup
-    if os.path.exists(temp_audio):
-        os.remove(temp_audio)
+        # Build the main clip from all images with the subtitles on top
+        build_args = (images, audio_data['aligned_data'], sub_position, video_size, fit, subtitle_style,
+                      not burn_ass, image_digests)
+        renderer, video_clip, subtitles = build_renderer(*build_args)
+        subtitles_end = subtitles.end
+        if burn_ass:
+            with span("layout_subtitles"):
+                pages = layout_subtitles(audio_data['aligned_data'], video_size[1], sub_position,
+                                         rasterize=False, **(subtitle_style or {}))
+            subtitles_end = max((page['end'] for page in pages), default=0)
 
+        # Step 1: Adjust the video speed (visual only)
+        final_duration = max(video_clip.duration, subtitles_end) / playback_speed
+        fps = encoder['fps']
+        n_frames = int(final_duration * fps)
+
+        # Optional window of the output: one image segment or a time range
+        if segment is not None:
+            if not 0 <= segment < len(video_clip.timings) - 1:
+                raise ValueError(f"Segment {segment} out of range, the video has {len(video_clip.timings) - 1} segments")
+            time_range = (video_clip.timings[segment] / playback_speed, video_clip.timings[segment + 1] / playback_speed)
+        first, last = 0, n_frames
+        if time_range is not None:
+            first = min(n_frames, first_frame_at(max(0.0, time_range[0]) * playback_speed, fps, playback_speed))
+            last = max(first, min(n_frames, first_frame_at(time_range[1] * playback_speed, fps, playback_speed)))
+            print(f"rendering frames {first}-{last} of {n_frames}")
+        windowed = (first, last) != (0, n_frames)
+        if progress:
+            progress(0, last - first)
+
+        # Step 2: Speed up the voiceover, loop and scale the background and mix
+        # them in one ffmpeg pass into a lossless WAV
+        background_audio_path = audio_data['background_music_path']
+        if background_audio_path is not None and os.path.exists(background_audio_path):
+            print("background audio path exists")
+        else:
+            background_audio_path = None
+        mix_duration = final_duration if background_audio_path else None
+        if windowed:
+            mix_duration = (last - first) / fps
+        with span("mix_audio"):
+            if ducking is not None and background_audio_path is not None:
+                digests = {}
+                if manifest is not None:
+                    for name in ('voiceover', 'background'):
+                        if manifest[name] is not None:
+                            digests[manifest[name]['path']] = manifest[name]['sha256']
+                mix_ducked(audio_data['raw_audio_path'], temp_mix, background_audio_path, playback_speed,
+                           background_volume, ducking, audio_data['aligned_data'],
+                           duration=mix_duration, start=first / fps if windowed else None,
+                           voice_digest=digests.get(audio_data['raw_audio_path']),
+                           background_digest=digests.get(background_audio_path))
+            else:
+                mix_audio(audio_data['raw_audio_path'], temp_mix, playback_speed,
+                          background_path=background_audio_path, background_volume=background_volume,
+                          duration=mix_duration, start=first / fps if windowed else None)
+
+        # Step 3: Stream the frames straight into ffmpeg
+        video_filter = None
+        if burn_ass:
+            # Times in the .ass match this output, windowed renders start at 0
+            ass_path = write_ass(pages, os.path.splitext(output_path)[0] + ".ass", video_size,
+                                 playback_speed, offset=first / fps)
+            video_filter = subtitles_filter(ass_path)
+            print(f"subtitles written to {ass_path}, burnt in with libass")
+            if (segment_workers > 1 or incremental) and not windowed:
+                print("ass subtitles are burnt in a single pass, segment rendering is skipped")
+        if renditions and (segment_workers > 1 or incremental) and not windowed and not burn_ass:
+            print("renditions are encoded in a single pass, segment rendering is skipped")
+
+        if (segment_workers > 1 or incremental) and not windowed and not burn_ass and not renditions:
+            # Cut at the image changes, encode the segments (side by side with
+            # segment_workers > 1) and join them with a stream copy; the audio is
+            # muxed once during the join. Incremental runs reuse every segment
+            # whose key is already in the render cache.
+            ranges = segment_frame_ranges(video_clip.timings, n_frames, fps, playback_speed)
+            keys = [None] * len(ranges)
+            if incremental:
+                n_images = len(audio_data['aligned_data'])
+                keys = segment_keys(ranges, images[:n_images], video_clip, subtitles, video_size, fps,
+                                    playback_speed, encoder, fit, (image_digests or [])[:n_images] or None)
+            paths = [SEGMENT_CACHE.get_path(key) if key else None for key in keys]
+            missing = [idx for idx, path in enumerate(paths) if path is None]
+
+            segment_done = None
+            if progress:
+                finished = [sum(b - a for (a, b), path in zip(ranges, paths) if path is not None)]
+
+                def segment_done(frames):
+                    finished.append(frames)
+                    progress(sum(finished), n_frames)
+
+            segment_dir = workspace.directory("segments")
+            jobs = [(*ranges[idx], os.path.join(segment_dir, f"segment_{idx:04d}.mp4")) for idx in missing]
+            with span("encode_segments", preset=encoder['preset'], segments=len(ranges),
+                      reused=len(ranges) - len(missing)) as trace:
+                segment_stats = render_segments(build_renderer, build_args, jobs, video_size, fps,
+                                                playback_speed, encoder, segment_workers, renderer,
+                                                progress=segment_done)
+                trace['frames'] = sum(s['frames'] for s in segment_stats)
+            for idx, (_, _, path) in zip(missing, jobs):
+                paths[idx] = SEGMENT_CACHE.put_file(keys[idx], path, evict=False) if incremental else path
+            with span("concat_segments"):
+                concat_segments(paths, output_path, encoder, audio_path=temp_mix,
+                                list_path=workspace.file("segments.txt"))
+            if incremental:
+                SEGMENT_CACHE.evict()
+            print(f"encoded {len(missing)} of {len(ranges)} segments ({trace['frames']} frames), "
+                  f"{len(ranges) - len(missing)} reused from the render cache, written to {output_path}")
+        else:
+            def frames():
+                for frame_index in range(first, last):
+                    # report once per second of video
+                    if progress and frame_index > first and (frame_index - first) % fps == 0:
+                        progress(frame_index - first, last - first)
+                    yield renderer.get_frame(frame_index / fps * playback_speed)
 
+            # cpu_s of this span is frame composition, child_cpu_s is ffmpeg/x264
+            with span("encode", preset=encoder['preset']) as trace:
+                stats = encode_frames(frames(), video_size, output_path, encoder, audio_path=temp_mix,
+                                      video_filter=video_filter, renditions=renditions)
+                trace['frames'] = stats['frames']
+                trace['composed_frames'] = renderer.stats()['composed']
+            if progress:
+                progress(stats['frames'], last - first)
+            print(f"encoded {stats['frames']} frames in {stats['seconds']:.2f}s "
+                  f"({stats['fps']:.1f} fps), {stats['bytes']} bytes written to {output_path}")
+            for item in stats['renditions']:
+                print(f"rendition {item['size'][0]}x{item['size'][1]}: {item['bytes']} bytes written to {item['output']}")
+            print("frame composition: ", renderer.stats())
@@ -0,0 +1,69 @@
+#############################
+# workspace.py
+#############################
+# Per-job scratch directories and atomic file writes, so several renders can
+# share one machine (and one cache directory) without touching each other's
+# intermediate files.
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+SCRATCH_ROOT = os.environ.get("SHORTGEN_SCRATCH_DIR", "temp/jobs")
+RAM_SCRATCH_ROOT = "/dev/shm"
+
+
+class Workspace:
+    """
+    A private scratch directory for one job, removed with everything in it
+    when the `with` block exits, whether the job succeeded or failed.
+    in_memory: place the directory on tmpfs (/dev/shm) when available, so
+    intermediates such as the mixed audio and segment files never hit the disk
+    """
+
+    def __init__(self, in_memory=False, root=None, prefix="job_"):
+        if root is None:
+            root = RAM_SCRATCH_ROOT if in_memory and os.path.isdir(RAM_SCRATCH_ROOT) else SCRATCH_ROOT
+        os.makedirs(root, exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix=prefix, dir=root)
+
+    def file(self, name):
+        """Path of `name` inside the workspace"""
+        return os.path.join(self.path, name)
+
+    def directory(self, name):
+        """Create the sub-directory `name` and return its path"""
+        path = self.file(name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def cleanup(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+        return False
+
+
+@contextmanager
+def atomic_write(path, mode="wb"):
+    """
+    Open a temporary file next to `path` for writing and move it over `path`
+    only when the block succeeds, so readers never see a partial file.
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise